@@ -6,10 +6,10 @@
 import trace
 import sheet
 import visio
-import hosttypes
+import hosttype
 import run
 
 __author__ = 'Michael Belousov <michael.belousov98@gmail.com>'
 __version__ = '0.0.1'
-__all__ = ['trace', 'sheet', 'visio', 'hosttypes']
+__all__ = ['trace', 'sheet', 'visio', 'hosttype']
 
@@ -2,21 +2,35 @@
 
 """
 Connect to a cisco router and generate xml for visio.py
-by following mac traces to arp entries
+by following mac traces to arp entries, or to every router
+of an inventory file, e.g.
+
+    # router    vrfs...
+    rtr1        VRF1 VRF2
+    rtr2        VRF1
 """
 
 __author__ = 'Michael Belousov'
 
 from getpass import getpass
 from netmiko import ConnectHandler
-from ciscotraceparser import log_to_visioxml
-from ciscotraceparser import p_showipcmd
+from ciscotraceparser import log_to_networks
+from ciscotraceparser import parse_log, TraceMac
 # from ciscotraceparser import ParseException
+from xmltodict import unparse as xmldump
+from collections import OrderedDict as odict
 import argparse
 import os, sys
 import traceback
+import queue
+import threading
+import time
+import csv
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import visio
 import sheet
+import tracecache
 
 debug = False
 """global storing whether the script is 
@@ -26,6 +40,38 @@ maxtracetries = 2
 """maximum amount of retries for a failed
 trace command"""
 
+retrybackoff = 1.0
+"""seconds before the first retry of failed
+trace commands, doubling for each next one"""
+
+sessions = 1
+"""default number of ssh sessions to a router
+trace mac commands are spread over"""
+
+router_sessions = {}
+"""router to a cap on its number of sessions,
+for routers that limit their vty lines"""
+
+batchsize = 1
+"""number of trace mac commands written to a
+session at once, without waiting for each one's
+prompt, 1 sends each with send_command"""
+
+pipelinetimeout = 60
+"""seconds pipelined commands can go without
+output before they're given up on"""
+
+mactracecache = None
+"""tracecache.MacTraceCache trace_arps reuses
+trace mac outputs from by default, None for none"""
+
+workers = 4
+"""default number of vrfs scanned at once over
+all the routers of an inventory"""
+
+summaryname = 'summary.csv'
+"""name of the run summary written to the outdir"""
+
 default_conn= {
         'device_type':      'cisco_ios',
         'port':             22,
@@ -59,35 +105,240 @@ def CiscoPromptConnectHandler(*args, **kwargs):
         raise
 
 
+def poolsize(router, n=None):
+    """number of sessions to open to router, n or the
+    default, capped by router_sessions"""
+    n = sessions if n is None else n
+    return max(1, min(n, router_sessions.get(router, n)))
+
+
+class SessionPool:
+    """
+    a pool of up to size ssh sessions to a router, opened
+    as they're needed by calling connect, ssh is an already
+    open session to use first, which the pool doesn't close
+    """
+    def __init__(self, connect, size=1, ssh=None, window=None):
+        self.connect = connect
+        self.size = size
+        self.window = batchsize if window is None else window
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.Queue()
+        self.opened = []
+        if ssh is not None:
+            self.idle.put(ssh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for ssh in self.opened:
+            ssh.disconnect()
+        self.opened.clear()
+
+    def send_command(self, cmd):
+        """send cmd on an idle session, returns its output"""
+        return self.send_batch([cmd])[0]
+
+    def send_batch(self, cmds):
+        """send cmds on an idle session, pipelined if there's
+        more than one, returns their outputs"""
+        with self.slots:
+            try:
+                ssh = self.idle.get_nowait()
+            except queue.Empty:
+                # no more than size commands run at once, so every
+                # session being busy means fewer than size are open
+                ssh = self.connect()
+                self.opened.append(ssh)
+            try:
+                if len(cmds) == 1:
+                    outs = [ssh.send_command(cmds[0])]
+                else:
+                    outs = send_pipelined(ssh, cmds)
+            except Exception:
+                # closed or out of step with its prompts, open
+                # a new one in its place next time
+                if ssh in self.opened:
+                    self.opened.remove(ssh)
+                    try:
+                        ssh.disconnect()
+                    except Exception:
+                        pass
+                raise
+            self.idle.put(ssh)
+            return outs
+
+    def send_commands(self, cmds):
+        """send cmds over the pool's sessions, window at a
+        time on each, returns their outputs in the same
+        order as cmds, None for those of batches that
+        failed to send, see try_send"""
+        batches = [cmds[i:i + self.window]
+                   for i in range(0, len(cmds), self.window)]
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return [out for outs in executor.map(
+                        lambda batch: try_send(self.send_batch, batch),
+                        batches)
+                    for out in outs]
+
+
+def split_prompt(out):
+    """split a command's output, as send_command
+    returns it, into the output and the next prompt"""
+    lines = out.split('\n')
+    return '\n'.join(lines[:-1]), lines[-1]
+
+
 # TODO: validate and replace if possible
 def output_as_cmd(cmd, out):
     """rebuild the missing command prompt, and strip
     off the next one from a command's output"""
-    lines = out.split('\n')
-    # create last command prompt
-    prompt = lines[-1]
-    # remove next command prompt
-    out = '\n'.join(lines[:-1])
+    # create last command prompt, remove next command prompt
+    out, prompt = split_prompt(out)
     # compose
     return f'{prompt}{cmd}\n{out}\n'
 
 
-def trace_arps(router, ssh, arps, outdir=os.curdir):
+def split_outputs(text, cmds):
+    """
+    split the channel text of pipelined cmds, each echoed
+    then followed by its output and the next prompt, into
+    their outputs as send_command would return them
+    """
+    text = text.replace('\r', '')
+    # the text ends in the prompt the last command left
+    _, prompt = split_prompt(text)
+    outs = []
+    pos = 0
+    for cmd in cmds:
+        echo = text.find(cmd, pos)
+        if echo < 0:
+            raise Exception(f'no echo of {cmd!r} in pipelined output')
+        start = text.find('\n', echo) + 1
+        end = text.find(f'\n{prompt}', start - 1) + 1 + len(prompt)
+        outs.append(text[start:end])
+        pos = end
+    return outs
+
+
+def send_pipelined(ssh, cmds, timeout=None):
+    """
+    send cmds over ssh at once, without waiting for each
+    one's prompt, returns their outputs as send_command
+    would, in order, fails after timeout seconds without
+    any output
+    """
+    timeout = pipelinetimeout if timeout is None else timeout
+    prompt = ssh.find_prompt()
+    newline = getattr(ssh, 'RETURN', '\n')
+    ssh.write_channel(''.join(f'{cmd}{newline}' for cmd in cmds))
+    text = ''
+    last = time.monotonic()
+    # every command ends with a prompt
+    while text.replace('\r', '').count(f'\n{prompt}') < len(cmds):
+        new = ssh.read_channel()
+        if new:
+            text += new
+            last = time.monotonic()
+        elif time.monotonic() - last > timeout:
+            raise Exception(f'pipelined commands timed out after '
+                            f'{text.count(prompt)} of {len(cmds)}')
+        else:
+            time.sleep(0.01)
+    return split_outputs(text, cmds)
+
+
+def try_send(send, cmds):
+    """send cmds with send, a function of a list of commands
+    to their outputs, returns None for each if it fails, e.g.
+    on a timeout or a closed session"""
+    try:
+        return send(cmds)
+    except Exception as e:
+        print(f'sending {len(cmds)} commands failed: '
+              f'{type(e).__name__}: {e}')
+        return [None] * len(cmds)
+
+
+def parse_trace(cmd, out, dst):
+    """the TraceMac of a trace mac's output, if it parses
+    cleanly as a trace to dst, otherwise None, as it is
+    for outputs of None"""
+    if out is None:
+        return None
+    try:
+        cmds, failed = parse_log(output_as_cmd(cmd, out), tolerant=True)
+    except Exception:
+        return None
+    if (failed or len(cmds) != 1 or not isinstance(cmds[0], TraceMac)
+            or cmds[0].dest_mac != dst):
+        return None
+    return cmds[0]
+
+
+def trace_ok(cmd, out, dst):
+    """whether a trace mac's output parses cleanly, as a
+    trace to dst, errors included, rather than having been
+    cut off or jumbled"""
+    return parse_trace(cmd, out, dst) is not None
+
+
+def send_traces(cmds, dsts, send, tries=None, backoff=None):
+    """
+    send trace mac cmds to dsts with send, a function of a list
+    of commands to their outputs, and resend only those whose
+    output isn't clean, see trace_ok, up to tries more times
+    each, waiting backoff seconds before the first resend and
+    twice as long before each next one, commands send fails
+    to send, or gives outputs of None for, count as not clean,
+    returns the outputs and the indices of cmds that never
+    came back clean
+    """
+    tries = maxtracetries if tries is None else tries
+    delay = retrybackoff if backoff is None else backoff
+    outs = try_send(send, cmds)
+    bad = [i for i, (cmd, out, dst) in enumerate(zip(cmds, outs, dsts))
+           if not trace_ok(cmd, out, dst)]
+    for _ in range(tries):
+        if not bad:
+            break
+        # weird, right? well basically, a bad output probably just
+        # means a couple of lines were jumbled by netmiko, which
+        # isn't likely to happen to the same command twice
+        print(f'retrying {len(bad)} traces in {delay}s...')
+        time.sleep(delay)
+        delay *= 2
+        for i, out in zip(bad, try_send(send, [cmds[i] for i in bad])):
+            outs[i] = out
+        bad = [i for i in bad if not trace_ok(cmds[i], outs[i], dsts[i])]
+    return outs, bad
+
+
+def trace_arps(router, ssh, arps, outdir=os.curdir, pool=None,
+               cache=None):
     """
     given an arp table, for a vrf, and an ssh connection, 
     cisco-tracemac all of the IPs, and save the network
-    graph, log, and xml to outdir
+    graph, log, and xml to outdir, if a SessionPool is
+    given the traces are spread over its sessions, fresh
+    outputs in the MacTraceCache, by default mactracecache,
+    are used instead of tracing again, returns the trace
+    commands given up on, left out of the log
     """
+    cache = mactracecache if cache is None else cache
     log = arps
     # TODO: automagically rerun ssh flops here too?
-    parsed = p_showipcmd.parseString(arps, 
-            parseAll=True)
-    vrf = parsed['asset']
+    table, = parse_log(arps)
+    vrf = table.vrf
     root = None
     try: 
         root, = (
-            e for e in parsed.entries if 
-            e.age == '-' and 
+            e for e in table.entries if 
+            e.age is None and 
             # TODO: interface types in grammar
             e.interface.startswith('Port'))
     except Exception as e:
@@ -96,19 +347,63 @@ def trace_arps(router, ssh, arps, outdir=os.curdir):
     vlid = None
     try:
         vlid = [
-            e.vlan_id for e in parsed.entries if
-            'vlan_id' in e][0]
+            e.vlan for e in table.entries if
+            e.vlan is not None][0]
     except Exception as e:
         print(f'could not find vlan id for {vrf}')
         raise
             
-    # iter over non-root entries and trace mac
-    for entry in parsed.entries[1:]:
+    # iter over non-root entries and trace mac, once per mac
+    cmds = []
+    dsts = []
+    seen = set()
+    for entry in table.entries[1:]:
         src = root.mac  # aliased cuz line size
         dst = entry.mac
-        cmd = f'trace mac {src} {dst} vlan {vlid}'
-        out = ssh.send_command(cmd)
-        log += output_as_cmd(cmd, out)
+        if dst in seen:
+            continue
+        cmds.append(f'trace mac {src} {dst} vlan {vlid}')
+        dsts.append(dst)
+        seen.add(dst)
+    if pool is None:
+        def send_batch(batch):
+            if len(batch) == 1:
+                return [ssh.send_command(batch[0])]
+            return send_pipelined(ssh, batch)
+
+        def send(cmds):
+            outs = []
+            for i in range(0, len(cmds), batchsize):
+                outs.extend(try_send(send_batch, cmds[i:i + batchsize]))
+            return outs
+    else:
+        send = pool.send_commands
+    # splice in cached outputs, only tracing new or expired pairs
+    outs = [None] * len(cmds)
+    if cache is not None:
+        for i, dst in enumerate(dsts):
+            outs[i] = cache.get(router, root.mac, dst, vlid)
+    todo = [i for i, out in enumerate(outs) if out is None]
+    if len(todo) < len(cmds):
+        print(f'{len(cmds) - len(todo)} traces from cache')
+    traced, bad = send_traces([cmds[i] for i in todo],
+                              [dsts[i] for i in todo], send)
+    for i, out in zip(todo, traced):
+        outs[i] = out
+    bad = [todo[i] for i in bad]
+    for i in bad:
+        print(f'giving up on {cmds[i]!r}, left out of the log')
+    if cache is not None:
+        # only completed traces, errors are worth retrying next run
+        done = set(todo) - set(bad)
+        cache.update((router, root.mac, dsts[i], vlid, outs[i])
+                     for i in sorted(done)
+                     if parse_trace(cmds[i], outs[i], dsts[i]).err is None)
+    # logged in arp table order, however the sessions finished
+    bad = set(bad)
+    for i, (cmd, out) in enumerate(zip(cmds, outs)):
+        if i not in bad:
+            log += output_as_cmd(cmd, out)
 
     # write command log
     prefix = f'{router}_{vrf}'
@@ -117,90 +412,156 @@ def trace_arps(router, ssh, arps, outdir=os.curdir):
         f.write(log)
     print(f'written to {ciscotracefile}')
 
-    # write trace xml
-    try:
-        xml = log_to_visioxml(log)
-    except Exception as e:
-        # weird, right? well basically, if the function
-        # failed, that probably just means a couple of 
-        # lines were jumbled by netmiko. This recursion 
-        # will automatically rerun it for you so you don't 
-        # have to, isn't likely to fail twice, but there 
-        # is some global retry cap to prevent anything silly
-        global tries
-        try:
-            tries += 1
-        except NameError:
-            tries = 1
-        if tries <= maxtracetries:
-            print('retrying scan...')
-            trace_arps(router, ssh, arps, outdir=os.curdir)
-            tries = 0
-            return
-        else: 
-            raise
+    # build the network model, handed to visio and sheet in memory
+    networks = log_to_networks(log)
 
+    # write csv
+    csvfile = os.path.join(outdir, f'{prefix}.csv')
+    sheet.run(networks, csvfile)
+    print(f'{vrf} tabled')
+
+    # write trace xml, only kept as an artifact now, before
+    # graphing so it's there even if graphing fails
     xmlfile = os.path.join(outdir, f'{prefix}.xml')
     with open(xmlfile, 'w') as f:
-        f.write(xml)
+        f.write(xmldump(networks, pretty=True))
     print(f'{vrf} written in xml')
 
     # write graph svg
     # TODO: better handling of this
     try:
-        visio.run(xml, outdir, metadata={})
+        visio.run(networks, outdir, metadata={})
     except TypeError as e:
-        xml = f"""\
-                <networks>
-                    <network>
-                        <networkname>
-                        {vrf}_{router}
-                        </networkname>
-                        <hosts>
-                            <host>
-                                <hostname>{root}</hostname>
-                                <address>{root}</address>
-                                <trace></trace>
-                            </host>
-                        </hosts>
-                    </network>
-                </networks>
-                """
-        visio.run(xml, outdir, metadata={})
+        networks = odict(networks=odict(network=[odict(
+                networkname=f'{vrf}_{router}',
+                hosts=odict(host=[odict(
+                    hostname=str(root.ip),
+                    address=str(root.ip),
+                    trace=None)]))]))
+        visio.run(networks, outdir, metadata={})
         print(f'vrf data ungraphable, using base instead')
     print(f'{vrf} graphed')
+    return [cmds[i] for i in sorted(bad)]
 
-    # write csv
-    csvfile = os.path.join(outdir, f'{prefix}.csv')
-    sheet.run(xml, csvfile)
-    print(f'{vrf} tabled')
 
+def read_inventory(f):
+    """
+    (router, vrf) pairs from an inventory file, each line
+    a router followed by its vrfs, # starts a comment
+    """
+    inventory = []
+    for line in f:
+        fields = line.partition('#')[0].split()
+        if not fields:
+            continue
+        router, *vrfs = fields
+        if not vrfs:
+            raise Exception(f'no vrfs listed for {router} in inventory')
+        inventory.extend((router, vrf) for vrf in vrfs)
+    return inventory
 
-def scan(username, password, router, vrfs, outdir):
-    """query the router for the cam tables of the 
-    following vrfs, and return an XML string of
-    the vrf's composition for visio graphing"""
-    with CiscoPromptConnectHandler(
+
+VrfResult = namedtuple('VrfResult',
+                       ('router', 'vrf', 'ok', 'seconds', 'error',
+                        'givenup'))
+VrfResult.__doc__ = """how scanning a router's vrf went, error is
+the reason it failed, or None, givenup the trace commands
+left out of its results after running out of retries"""
+
+
+def scan_vrf(router, vrf, pool, outdir):
+    """query a router's arp table for vrf over the pool's
+    sessions, and trace it, returns the traces given up
+    on, see trace_arps"""
+    cmd = f'show ip arp vrf {vrf}'
+    out = pool.send_command(cmd)
+    log = output_as_cmd(cmd, out)
+    return trace_arps(router, None, log, outdir, pool)
+
+
+def write_summary(results, output):
+    """write VrfResults as a csv run summary to output,
+    a path or file, vrfs with traces given up on are
+    partial"""
+    if isinstance(output, str):
+        output = open(output, 'w')
+    with output:
+        csvfile = csv.writer(output, lineterminator='\n')
+        csvfile.writerow(('router', 'vrf', 'status', 'seconds', 'error',
+                          'givenup'))
+        for r in results:
+            status = 'failed' if not r.ok else \
+                     'partial' if r.givenup else 'ok'
+            csvfile.writerow((r.router, r.vrf, status,
+                              f'{r.seconds:.1f}', r.error or '',
+                              '; '.join(r.givenup)))
+
+
+def run_inventory(inventory, username, password, outdir, nworkers=None,
+                  jobs=None, connect=None):
+    """
+    scan the (router, vrf) pairs of an inventory, up to nworkers,
+    by default workers, vrfs at once overall, each router over a SessionPool of up
+    to jobs sessions, see poolsize, shared by its vrfs, writes
+    results per router and vrf, and a run summary, to outdir,
+    returns the VrfResults, connect(router) opens a session,
+    by default a netmiko one
+    """
+    if connect is None:
+        connect = lambda router: CiscoPromptConnectHandler(
                 username=username,
                 password=password,
                 ip=router,
-                **default_conn) as ssh:
-        print(f'Querying Router {router}...')
-        for vrf in vrfs:
-            log = ''
-            print(f'Visualizing {vrf}...')
-            # get arp cache for vrf
-            cmd = f'show ip arp vrf {vrf}'
-            out = ssh.send_command(cmd)
-            log = output_as_cmd(cmd, out)
-            try:
-                log = trace_arps(router, ssh, log, outdir)
-            except Exception as e:
-                print(f'{vrf} scan failed')
-                print(e)
-                traceback.print_exc(file=sys.stdout)
-            print(f'done visualizing {vrf}...')
-            print()
+                **default_conn)
+    pools = {}
+    for router, _ in inventory:
+        if router not in pools:
+            pools[router] = SessionPool(lambda router=router: connect(router),
+                                        poolsize(router, jobs))
+
+    def job(pair):
+        router, vrf = pair
+        print(f'Visualizing {vrf} on {router}...')
+        start = time.perf_counter()
+        error = None
+        givenup = []
+        try:
+            givenup = scan_vrf(router, vrf, pools[router], outdir)
+        except Exception as e:
+            print(f'{vrf} on {router} scan failed')
+            traceback.print_exc(file=sys.stdout)
+            error = f'{type(e).__name__}: {e}'
+        seconds = time.perf_counter() - start
+        print(f'done visualizing {vrf} on {router} in {seconds:.1f}s')
+        return VrfResult(router, vrf, error is None, seconds, error,
+                         givenup)
+
+    nworkers = workers if nworkers is None else nworkers
+    try:
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            results = list(executor.map(job, inventory))
+    finally:
+        for pool in pools.values():
+            pool.close()
+    write_summary(results, os.path.join(outdir, summaryname))
+    failed = [r for r in results if not r.ok]
+    print(f'{len(results) - len(failed)} of {len(results)} vrfs scanned')
+    for r in failed:
+        print(f'  {r.router} {r.vrf}: {r.error}')
+    for r in results:
+        if r.givenup:
+            print(f'  {r.router} {r.vrf}: gave up on '
+                  f'{len(r.givenup)} traces')
+    return results
+
+
+def scan(username, password, router, vrfs, outdir, jobs=None,
+         connect=None):
+    """query the router for the cam tables of the 
+    following vrfs, one after the other, see run_inventory"""
+    print(f'Querying Router {router}...')
+    return run_inventory([(router, vrf) for vrf in vrfs], username,
+                         password, outdir, 1, jobs, connect)
 
 
 if __name__ == '__main__':
@@ -209,16 +570,75 @@ if __name__ == '__main__':
             description='a utility for tracing active hosts in router vrfs')
     p.add_argument('-r', '--router', default='REDACTED',
             help='router to query')
-    p.add_argument('VRFs', type=str, nargs='+',
+    p.add_argument('VRFs', type=str, nargs='*',
             help='vrfs to scan')
+    p.add_argument('-i', '--inventory', default=None,
+            help='file of routers to scan, each on a line followed '
+            'by its vrfs, instead of or as well as -r\'s')
+    p.add_argument('-w', '--workers', type=int, default=workers,
+            help='number of vrfs to scan at once over all routers')
     p.add_argument('-d', '--debug', action='store_true',
             help='activate debug mode for verbose errors')
     p.add_argument('-o', '--outdir', default=os.curdir,
             help='router to query')
+    p.add_argument('-j', '--jobs', type=int, default=sessions,
+            help='number of ssh sessions to trace over per router')
+    p.add_argument('-b', '--batch-size', type=int, default=batchsize,
+            help='number of commands written to a session at once, '
+            'without waiting for each one\'s prompt')
+    p.add_argument('-S', '--router-sessions', nargs='+', default=[],
+            metavar='ROUTER=N',
+            help='caps on the number of sessions to some routers')
+    p.add_argument('-C', '--cache', default=None,
+            help='path of a persistent cache of trace mac outputs to '
+            'reuse instead of tracing again')
+    p.add_argument('-t', '--cache-ttl', type=float,
+            default=tracecache.default_ttl / 3600,
+            help='hours before a cached trace mac output is traced again')
+    p.add_argument('--fake', type=int, default=None, metavar='HOSTS',
+            help='trace local fake routers with this many hosts '
+            'per vrf instead, see fakeios.py')
+    p.add_argument('--latency', type=float, default=0.1,
+            help='seconds each command takes on the fake routers')
+    p.add_argument('--rtt', type=float, default=0.05,
+            help='seconds of a round trip to the fake routers')
+    p.add_argument('--flaky', type=float, default=0.0,
+            help='fraction of trace outputs the fake routers cut off')
     args = p.parse_args()
 
+    for cap in args.router_sessions:
+        r, _, n = cap.partition('=')
+        router_sessions[r] = int(n)
+    debug = args.debug
+    batchsize = args.batch_size
+    if args.cache is not None:
+        mactracecache = tracecache.MacTraceCache(args.cache,
+                                                 args.cache_ttl * 3600)
+
+    inventory = [(args.router, vrf) for vrf in args.VRFs]
+    if args.inventory is not None:
+        with open(args.inventory) as f:
+            inventory.extend(read_inventory(f))
+    if not inventory:
+        p.error('no vrfs to scan, list them or give an inventory')
+
+    if args.fake is not None:
+        import fakeios
+        fakes = {}
+        for router, vrf in inventory:
+            fakes.setdefault(router, {})[vrf] = args.fake
+        fakes = {router: fakeios.FakeRouter(router, vrfs, args.latency,
+                                            rtt=args.rtt, flaky=args.flaky)
+                 for router, vrfs in fakes.items()}
+        run_inventory(inventory, None, None, args.outdir, args.workers,
+                      args.jobs, lambda router: fakes[router].connect())
+        for router, fake in fakes.items():
+            print(f'{router}: {len(fake.commands)} commands over '
+                  f'{fake.maxsessions} sessions')
+        sys.exit()
+
     username = input('Username: ')
     password = getpass('Password: ')
-    debug = args.debug
 
-    scan(username, password, args.router, args.VRFs, args.outdir)
+    run_inventory(inventory, username, password, args.outdir, args.workers,
+                  args.jobs)
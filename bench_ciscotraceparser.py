@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+
+"""
+Benchmark for ciscotraceparser.py's grammars.
+Generates synthetic logs of configurable sizes with synthlog.py,
+`show ip arp vrf` + `trace mac`, `show cdp neighbors detail` and
+`show spanning-tree`, and reports the lines/s, items/s (traces,
+neighbor entries, or spanning-tree vlans), peak memory and memory
+held by the results of parsing each with every grammar, checking
+the fast paths produce the same results as the pyparsing grammars.
+Trace mac logs are also parsed into pyparsing's raw ParseResults,
+to compare the memory they hold to the slotted records.
+
+USAGE
+    ./bench_ciscotraceparser.py
+    ./bench_ciscotraceparser.py -T 100 1000 5000 --odd 0.05
+    ./bench_ciscotraceparser.py -T 20000 -j 8 -g tracemac
+    ./bench_ciscotraceparser.py -D 50 500 -S 20 -V 100 --no-memory
+"""
+
+__author__ = 'Michael Belousov'
+
+import argparse
+import io
+import sys
+import time
+import tracemalloc
+from pyparsing import OneOrMore, Group
+import ciscotraceparser
+import synthlog
+
+cdp_separator = '-------------------------\n'
+"""line starting each neighbor entry"""
+
+p_spancmds = OneOrMore(Group(ciscotraceparser.p_spancmd))
+"""every vlan of one `show spanning-tree`"""
+
+
+def bodies(log):
+    """the output of each command in a log, without the prompt"""
+    for _, block in ciscotraceparser.split_blocks(log):
+        yield '\n'.join(block[1:])
+
+
+def cdp_pyparsing(log):
+    """parse a cdp log entry by entry with p_cdpneigh"""
+    return [ciscotraceparser.p_cdpneigh.parseString(cdp_separator + entry)
+            for body in bodies(log)
+            for entry in body.split(cdp_separator)[1:]]
+
+
+def cdp_fast(log):
+    """parse a cdp log with the cdp fast path"""
+    return list(ciscotraceparser.cdp_neighbors(io.StringIO(log)))
+
+
+def stp_pyparsing(log):
+    """parse a spanning-tree log command by command with p_spancmd"""
+    return [vlan for body in bodies(log)
+            for vlan in p_spancmds.parseString(body)]
+
+
+def stp_fast(log):
+    """parse a spanning-tree log with the spanning tree fast path"""
+    return list(ciscotraceparser.stp_vlans(io.StringIO(log)))
+
+
+def parseresults(log):
+    """parse a trace mac log into ParseResults, without records"""
+    return ciscotraceparser.p_block.parseString(log)
+
+
+def tracemac_log(size, args):
+    f = io.StringIO()
+    items = synthlog.write_tracemac_log(f, size, args.routers, args.vrfs,
+                                        odd=args.odd)
+    return f.getvalue(), items
+
+
+def cdp_log(size, args):
+    f = io.StringIO()
+    items = synthlog.write_cdp_log(f, size)
+    return f.getvalue(), items
+
+
+def stp_log(size, args):
+    f = io.StringIO()
+    items = synthlog.write_stp_log(f, size, args.vlans)
+    return f.getvalue(), items
+
+
+def parsers(grammar, args):
+    """
+    (name, parse) pairs to bench over a grammar's logs, the first
+    being the reference the others' results are checked against
+    """
+    if grammar == 'tracemac':
+        yield 'pyparsing', lambda l: ciscotraceparser.parse_log(l, False)
+        yield 'fast', lambda l: ciscotraceparser.parse_log(l, True)
+        if args.jobs > 1:
+            yield f'fast -j{args.jobs}', \
+                  lambda l: ciscotraceparser.parse_log(l, True, args.jobs)
+    elif grammar == 'cdp':
+        yield 'pyparsing', cdp_pyparsing
+        yield 'fast', cdp_fast
+    else:
+        yield 'pyparsing', stp_pyparsing
+        yield 'fast', stp_fast
+
+
+def representations(grammar):
+    """
+    (name, parse) pairs of other representations of a grammar's
+    results, only measured, not checked against the parsers'
+    """
+    if grammar == 'tracemac':
+        yield 'ParseResults', parseresults
+
+
+grammars = {
+    'tracemac': tracemac_log,
+    'cdp': cdp_log,
+    'stp': stp_log,
+}
+"""grammar name to the function writing its synthetic logs"""
+
+
+def bench(parse, log):
+    """time parse(log), returns (seconds, result)"""
+    start = time.perf_counter()
+    result = parse(log)
+    return time.perf_counter() - start, result
+
+
+def peak(parse, log):
+    """peak bytes of memory allocated while running parse(log)"""
+    tracemalloc.start()
+    parse(log)
+    _, size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def retained(parse, log):
+    """bytes of memory still held by the result of parse(log)"""
+    tracemalloc.start()
+    result = parse(log)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description='benchmark ciscotraceparser over synthetic logs')
+    p.add_argument('-g', '--grammars', nargs='+', choices=list(grammars),
+                    default=list(grammars),
+                    help='grammars to benchmark')
+    p.add_argument('-T', '--traces', type=int, nargs='+',
+                    default=[100, 1000, 5000],
+                    help='numbers of trace mac outputs in each log')
+    p.add_argument('-r', '--routers', type=int, default=1,
+                    help='routers the traces are split over')
+    p.add_argument('-v', '--vrfs', type=int, default=1,
+                    help='vrfs per router the traces are split over')
+    p.add_argument('-o', '--odd', type=float, default=0.01,
+                    help='fraction of hops written in shapes that '
+                    'fall back to pyparsing')
+    p.add_argument('-D', '--devices', type=int, nargs='+',
+                    default=[20, 200],
+                    help='numbers of switches in each cdp log')
+    p.add_argument('-S', '--switches', type=int, nargs='+',
+                    default=[10, 50],
+                    help='numbers of switches in each spanning-tree log')
+    p.add_argument('-V', '--vlans', type=int, default=10,
+                    help='vlans per switch in the spanning-tree logs')
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                    help='also time the fast path parsing in this '
+                    'many processes')
+    p.add_argument('-M', '--no-memory', action='store_true',
+                    help='skip measuring peak and held memory, which '
+                    'parses every log twice more, and the ParseResults')
+    args = p.parse_args()
+
+    sizes = {'tracemac': args.traces, 'cdp': args.devices,
+             'stp': args.switches}
+    print(f'{"grammar":>10} {"parser":>12} {"size":>7} {"lines":>8} '
+          f'{"items":>7} {"seconds":>8} {"lines/s":>9} {"items/s":>9} '
+          f'{"peak MiB":>9} {"held MiB":>9}')
+
+    def row(grammar, name, parse, size, log, lines, items, seconds):
+        mem = held = ''
+        if not args.no_memory:
+            mem = f'{peak(parse, log) / 2**20:.1f}'
+            held = f'{retained(parse, log) / 2**20:.1f}'
+        print(f'{grammar:>10} {name:>12} {size:>7} {lines:>8} '
+              f'{items:>7} {seconds:>8.3f} '
+              f'{lines / seconds:>9.0f} {items / seconds:>9.0f} '
+              f'{mem:>9} {held:>9}')
+
+    for grammar in args.grammars:
+        for size in sizes[grammar]:
+            log, items = grammars[grammar](size, args)
+            lines = log.count('\n')
+            expected = None
+            for name, parse in parsers(grammar, args):
+                seconds, result = bench(parse, log)
+                if expected is None:
+                    expected = result
+                elif len(result) != len(expected) or (
+                        grammar == 'tracemac' and result != expected):
+                    print(f'{grammar} {name} results differ over '
+                          f'{items} items')
+                    sys.exit(1)
+                row(grammar, name, parse, size, log, lines, items, seconds)
+            if args.no_memory:
+                continue
+            for name, parse in representations(grammar):
+                seconds, _ = bench(parse, log)
+                row(grammar, name, parse, size, log, lines, items, seconds)
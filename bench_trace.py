@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+"""
+Regression benchmark for trace.py's scan processing.
+Generates synthetic nmap scan logs with a configurable number of
+hosts, split across a configurable number of networks, and times
+trace.parse_result over each combination, so the cost of grouping
+hosts into networks can be checked to stay linear in the scan size.
+
+USAGE
+    ./bench_trace.py
+    ./bench_trace.py -H 10000 100000 500000 -N 1 100 1000 --check 3
+"""
+
+__author__ = 'Michael Belousov'
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from netaddr import IPAddress
+import trace
+
+base_addr = int(IPAddress('10.0.0.0'))
+"""first address of the synthetic scans"""
+
+hops_per_host = 3
+"""length of each synthetic trace"""
+
+
+def write_nmap_log(f, hosts):
+    """write a synthetic nmap xml log of traced hosts to f"""
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<!DOCTYPE nmaprun>\n'
+            '<nmaprun scanner="nmap" args="nmap -sn -Pn --traceroute">\n')
+    for i in range(hosts):
+        addr = IPAddress(base_addr + i)
+        f.write(f'<host><status state="up" reason="user-set"/>\n'
+                f'<address addr="{addr}" addrtype="ipv4"/>\n'
+                f'<hostnames>\n'
+                f'<hostname name="host{i}.example" type="PTR"/>\n'
+                f'</hostnames>\n'
+                f'<trace port="80" proto="tcp">\n')
+        for ttl in range(1, hops_per_host):
+            f.write(f'<hop ttl="{ttl}" ipaddr="172.16.{i % 256}.{ttl}" '
+                    f'rtt="0.50" host="gw{ttl}.example"/>\n')
+        f.write(f'<hop ttl="{hops_per_host}" ipaddr="{addr}" rtt="1.00"/>\n'
+                f'</trace>\n'
+                f'</host>\n')
+    f.write('<runstats><finished time="0" elapsed="0"/>'
+            f'<hosts up="{hosts}" down="0" total="{hosts}"/></runstats>\n'
+            '</nmaprun>\n')
+
+
+def ips_file(hosts, networks):
+    """
+    a *.ips file string splitting the synthetic hosts into
+    contiguous ranges, one per network
+    """
+    lines = []
+    per = max(1, hosts // networks)
+    for n in range(networks):
+        start = base_addr + n * per
+        end = base_addr + (hosts if n == networks - 1 else (n + 1) * per) - 1
+        if start > end:
+            break
+        lines.append(f'Net{n}: {IPAddress(start)}-{IPAddress(end)}')
+    return '\n'.join(lines)
+
+
+def bench(hosts, networks, workdir):
+    """time parse_result over one synthetic scan, returns seconds"""
+    logpath = os.path.join(workdir, f'nmap_{hosts}.xml')
+    if not os.path.exists(logpath):
+        with open(logpath, 'w') as f:
+            write_nmap_log(f, hosts)
+    trace.nmapxmlpath = logpath
+    trace.iplist = trace.IPFile()
+    trace.iplist.fromstr(ips_file(hosts, networks))
+    with open(os.devnull, 'w') as devnull:
+        start = time.perf_counter()
+        trace.parse_result(devnull)
+        return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description='benchmark trace.parse_result over synthetic nmap logs')
+    p.add_argument('-H', '--hosts', type=int, nargs='+',
+                    default=[10000, 100000, 500000],
+                    help='numbers of scanned hosts to benchmark')
+    p.add_argument('-N', '--networks', type=int, nargs='+',
+                    default=[1, 10, 100, 1000],
+                    help='numbers of networks to split the hosts into')
+    p.add_argument('-c', '--check', type=float, default=None,
+                    help='fail if the per-host time of any run exceeds the '
+                    'fastest per-host time by more than this factor')
+    args = p.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='.bench_trace') as workdir:
+        for hosts in args.hosts:
+            for networks in args.networks:
+                secs = bench(hosts, networks, workdir)
+                results.append((hosts, networks, secs))
+
+    print(f'{"hosts":>10} {"networks":>10} {"seconds":>10} {"us/host":>10}')
+    for hosts, networks, secs in results:
+        print(f'{hosts:>10} {networks:>10} {secs:>10.3f} '
+              f'{secs / hosts * 1e6:>10.2f}')
+
+    if args.check is not None:
+        perhost = [secs / hosts for hosts, _, secs in results]
+        ratio = max(perhost) / min(perhost)
+        print(f'per-host time spread: {ratio:.2f}x')
+        if ratio > args.check:
+            print('scaling regression: per-host time is not flat')
+            sys.exit(1)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""
+Maps a switching fabric from the `show cdp neighbors detail`
+output of many devices, instead of tracing every mac.
+
+Neighbor entries are streamed through ciscotraceparser's CDP
+fast path into an adjacency index, mapping each device's local
+interfaces to the device, port, and management ip on their other
+end. Each link is recorded from both of its ends, so a device
+that wasn't queried still gets the links its neighbors reported,
+and repeated dumps of the same device replace rather than
+duplicate its links.
+
+CLI USAGE:
+
+    ./cdpmap.py sw1.log sw2.log ... -o outdir
+
+    logs without prompts are taken to be from the device their
+    file is named after
+
+PYTHON USAGE:
+    >>> index = CdpIndex()
+    >>> index.update(cdp_neighbors(open('fabric.log')))
+    >>> index['sw1']['GigabitEthernet1/0/1']
+    Adjacency(device='sw2', port='GigabitEthernet1/0/49', ip=...)
+    >>> G = index.graph()
+"""
+
+__author__ = 'Michael Belousov'
+
+import argparse
+import os
+import re
+from collections import namedtuple
+import networkx as nx
+from ciscotraceparser import cdp_neighbors
+import visio
+
+Adjacency = namedtuple('Adjacency', ('device', 'port', 'ip'))
+Adjacency.__doc__ = """the other end of a local interface"""
+
+re_ipv4 = re.compile(r'[0-9]+(?:\.[0-9]+){3}')
+
+
+def devicename(device_id):
+    """
+    normalize a cdp device id or prompt hostname so both name
+    a device the same, e.g. SW2.example.com(FOC123) to sw2
+    """
+    name = device_id.partition('(')[0].lower()
+    if re_ipv4.fullmatch(name):
+        return name
+    return name.partition('.')[0]
+
+
+class CdpIndex:
+    """
+    deduplicated device adjacency index built from cdp neighbor
+    entries, device -> local interface -> Adjacency
+    """
+    def __init__(self):
+        self.adjacency = {}
+        """device to its local interfaces to their (device, port)"""
+        self.platforms = {}
+        """device to its platform string"""
+        self.addresses = {}
+        """device to its management ip"""
+        self.reported = set()
+        """(device, interface) pairs reported by the device itself"""
+
+    def add(self, device, neighbor):
+        """add a CdpNeighbor seen by device"""
+        device = devicename(device)
+        remote = devicename(neighbor.device_id)
+        ips = neighbor.mgmt_ips or neighbor.ips
+        ip = ips[0] if ips else None
+        if ip is not None:
+            self.addresses[remote] = ip
+        if neighbor.platform is not None:
+            self.platforms[remote] = neighbor.platform
+        self.adjacency.setdefault(device, {})
+        self.adjacency.setdefault(remote, {})
+        self.adjacency[device][neighbor.interface] = (remote, neighbor.port)
+        self.reported.add((device, neighbor.interface))
+        # the remote end as inferred from here, unless the remote
+        # device reported that interface itself
+        if (remote, neighbor.port) not in self.reported:
+            self.adjacency[remote][neighbor.port] = (
+                    device, neighbor.interface)
+
+    def update(self, pairs):
+        """add (device, CdpNeighbor) pairs, e.g. from cdp_neighbors"""
+        for device, neighbor in pairs:
+            self.add(device, neighbor)
+
+    def __getitem__(self, device):
+        """a device's local interfaces to their Adjacency"""
+        return {interface: Adjacency(remote, port, self.addresses.get(remote))
+                for interface, (remote, port)
+                in self.adjacency[devicename(device)].items()}
+
+    def __contains__(self, device):
+        return devicename(device) in self.adjacency
+
+    def __iter__(self):
+        return iter(self.adjacency)
+
+    def __len__(self):
+        return len(self.adjacency)
+
+    def links(self):
+        """
+        iterate over each link once, as
+        ((device, interface), (device, port)) pairs
+        """
+        for device, interfaces in self.adjacency.items():
+            for interface, (remote, port) in interfaces.items():
+                local = (device, interface)
+                other = (remote, port)
+                back = self.adjacency.get(remote, {}).get(port)
+                # a link seen from both ends is yielded from the lesser
+                if back != local or local < other:
+                    yield local, other
+
+    def graph(self):
+        """
+        the index as a networkx.Graph of devices, nodes have ip and
+        platform attributes, edges have a ports attribute mapping
+        each end's device to its interface
+        """
+        G = nx.Graph()
+        for device in self.adjacency:
+            G.add_node(device, ip=self.addresses.get(device),
+                       platform=self.platforms.get(device))
+        for (device, interface), (remote, port) in self.links():
+            G.add_edge(device, remote,
+                       ports={device: interface, remote: port})
+        return G
+
+    def labels(self):
+        """node labels for visio, the device name and ip"""
+        return {device: f'{device}\n{self.addresses.get(device) or ""}'
+                for device in self.adjacency}
+
+
+def render(index, outdir=os.curdir, title='cdp', metadata={}):
+    """
+    graph each connected part of the fabric with visio, rooted
+    at its most connected device, returns the svg file names
+    """
+    G = index.graph()
+    labels = index.labels()
+    files = []
+    parts = sorted(nx.connected_components(G), key=len, reverse=True)
+    for i, part in enumerate(parts):
+        sub = G.subgraph(part)
+        root = max(sub.degree, key=lambda d: d[1])[0]
+        name = title if len(parts) == 1 else f'{title}_{i}'
+        files.append(visio.visfromgraph(
+                sub, name, {n: labels[n] for n in sub}, root,
+                outpath=outdir, metadata=metadata))
+    return files
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description='map a switching fabric from show cdp neighbors '
+        'detail output')
+    p.add_argument('logs', nargs='+',
+        help='logs of show cdp neighbors detail commands')
+    p.add_argument('-o', '--outdir', default=os.curdir,
+        help='directory to write the graphs to')
+    p.add_argument('-t', '--title', default='cdp',
+        help='title of the graphs')
+    p.add_argument('-n', '--no-graph', action='store_true',
+        help='only print the adjacency index')
+    args = p.parse_args()
+
+    index = CdpIndex()
+    for log in args.logs:
+        device = os.path.splitext(os.path.basename(log))[0]
+        with open(log) as f:
+            index.update(cdp_neighbors(f, device))
+
+    for device in sorted(index):
+        print(device)
+        for interface, (remote, port, ip) in sorted(index[device].items()):
+            print(f'  {interface} -> {remote} {port} ({ip})')
+    if not args.no_graph:
+        render(index, args.outdir, args.title)
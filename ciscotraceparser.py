@@ -5,16 +5,27 @@ Utilities, including a Pyparsing-implemented grammar,
 for parsing cisco router traceroutes (trace mac) into
 XML for the visio script.
 
+`show ip arp vrf` and `trace mac` output is parsed by a
+line oriented regex fast path, blocks it doesn't recognize
+fall back to the pyparsing grammars. Either way, commands are
+returned as compact records (ArpTable, ArpEntry, TraceMac, Hop),
+with macs and ips stored as integers. `show cdp neighbors detail`
+and `show spanning-tree` output is streamed through fast paths of
+its own, see cdp_neighbors and stp_vlans.
+
 TODO:
     - present interface either as module, or cli
-    - use argparse
 
 CLI USAGE:
     
     ./ciscotraceparser < cmd_out.txt > out.xml
 
 PYTHON USAGE:
-    >>> outxml = traces_to_visoxml(trace_str, title='Title')
+    >>> outxml = log_to_visioxml(trace_str, title='Title')
+    >>> visio.run(log_to_networks(trace_str), outdir)  # no xml round trip
+    >>> for cmd in parse_log(trace_str):
+    ...     if isinstance(cmd, TraceMac):
+    ...         print(cmd.dest_mac, [str(hop.ip) for hop in cmd.hops])
     
 """
 
@@ -25,11 +36,16 @@ __author__ = 'Michael Belousov'
 # TODO: enumerate the many used pyparsing elements
 #
 from pyparsing import *  
-from functools import reduce
+from functools import reduce, lru_cache
 from operator import add
 from xmltodict import unparse as xmldump
-from collections import OrderedDict as odict
+from collections import OrderedDict as odict, namedtuple
 from netaddr import IPAddress
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor, Future
+import hashlib
+from parsecache import ParseCache
 
 # set pyparsing base class to suppress string literals
 # by default, e.g. '(' + Word(nums) + ')' will yield
@@ -98,29 +114,70 @@ p_url = seq(
 
 class hexint(int):
     """A hexidecimal represented integer"""
+    __slots__ = ()
     def __str__(self):
         return hex(self)
     def __repr__(self):
         return str(self)
 
+@lru_cache(maxsize=None)
 def makestrcmper_class(cls):
     """A wrapper around types that makes string 
     representation comparisons equivalent to regular 
     comparisons"""
     class StrCmper(cls):
+        __slots__ = ()
         def __eq__(self, other):
             if isinstance(other, str):
                 return str(self) == other
             else:
                 return super().__eq__(other)
-    StrCmper.__name__ = f'StrCmper({cls.__name__})'
-    StrCmper.__doc__ = makestrcmper_class.__doc__
+        # defining __eq__ would otherwise unset it
+        __hash__ = cls.__hash__
+    # named after the wrapped class, so it can be used as a class
+    # decorator and its instances can still be pickled
+    StrCmper.__name__ = cls.__name__
+    StrCmper.__qualname__ = cls.__qualname__
+    StrCmper.__module__ = cls.__module__
+    StrCmper.__doc__ = cls.__doc__ or makestrcmper_class.__doc__
     return StrCmper
 
 def makestrcmper(cls, *args, **kwargs):
     strcmpercls = makestrcmper_class(cls)
     return strcmpercls(*args, **kwargs)
 
+@makestrcmper_class
+class MACAddress(hexint):
+    """a mac address stored as an integer, represented in
+    cisco's dotted form, e.g. 0011.2233.4455"""
+    __slots__ = ()
+    @classmethod
+    def fromstr(cls, s):
+        value = int(s.replace('.', ''), 16)
+        if value >= 1 << 48:
+            raise ValueError(f'{s!r} is not a mac address')
+        return cls(value)
+    def __str__(self):
+        return f'{self >> 32:04x}.{self >> 16 & 0xffff:04x}.{self & 0xffff:04x}'
+    def __repr__(self):
+        return f'MACAddress({str(self)!r})'
+
+@makestrcmper_class
+class IPv4Address(int):
+    """an ipv4 address stored as an integer, represented in
+    dotted decimal"""
+    __slots__ = ()
+    @classmethod
+    def fromstr(cls, s):
+        octets = s.split('.')
+        if len(octets) != 4 or any(int(o) > 255 for o in octets):
+            raise ValueError(f'{s!r} is not an ipv4 address')
+        return cls(reduce(lambda a, o: a << 8 | int(o), octets, 0))
+    def __str__(self):
+        return '.'.join(str(self >> s & 0xff) for s in (24, 16, 8, 0))
+    def __repr__(self):
+        return f'IPv4Address({str(self)!r})'
+
 p_number = Word(nums)
 p_number.setParseAction(lambda s,l,t: int(t[0]))
 
@@ -135,8 +192,8 @@ p_mac = delimitedList(p_hex, '.', combine=True)             ('mac')
 # ip address
 p_ip = delimitedList(Word(nums), '.', combine=True)         ('ip')
 
-# NOTE: this is how it will be done in the future
-# p_ip.setParseAction(lambda s,l,t: makestrcmper(IPAddress, t[0]))
+# parsed ips are converted to IPv4Addresses along with the rest
+# of a command's output, see the records below the grammars
 
 # the ways vlans are identified in output
 p_vlan = (L('Vl') ^ L('Vlan')) + Word(nums)                 ('vlan_id')
@@ -293,10 +350,22 @@ p_spansect = seq(
         'ID',
         'Priority',
         Word(nums)                              ('priority'),
+        Optional(
+            LPAR
+            + 'priority' + Word(nums)           ('base_priority')
+            + 'sys-id-ext' + Word(nums)         ('sys_id_ext')
+            + RPAR),
         'Address',
         p_mac,
         Optional(
             'This bridge is the root')          ('root'),
+        Optional(
+            'Cost' + Word(nums)                 ('root_cost')),
+        Optional(
+            'Port' + Word(nums)                 ('root_port_id')
+            + LPAR
+            + Word(printables, excludeChars='()')('root_port')
+            + RPAR),
         'Hello Time',
         Word(nums)                              ('hello_time'),
         Word(alphas)                            ('hello_time_units'),
@@ -308,16 +377,21 @@ p_spansect = seq(
         Word(alphas)                            ('forw_delay_units'),
         Optional(
             'Aging Time'
-            + Word(nums))                       ('aging_time'),
+            + Word(nums)
+            + Optional(Word(alphas)))           ('aging_time'),
     )
 
+p_spanrole = oneOf('Root Desg Altn Back Mstr Disb')
+p_spansts = oneOf('FWD BLK LRN LIS BKN DIS')
+
 p_spaninterf = seq(
-        Combine('Po' + Word(nums))                          ('interface'),
-        Literal('Desg')                                     ('role'),
-        Literal('FWD')                                      ('sts'), 
+        Word(alphanums+'/.-')                               ('interface'),
+        p_spanrole                                          ('role'),
+        p_spansts                                           ('sts'), 
         Word(nums)                                          ('cost'), 
-        Combine(Word(nums) + PERIOD + Word(nums))           ('priority'), 
-        Literal('P2p')                                      ('type')
+        Combine(Word(nums) + '.' + Word(nums))              ('priority'), 
+        # P2p, Shr, optionally followed by Edge, Peer(STP)...
+        Regex(r'[^\n]*[^\s]')                              ('type')
     )
 
 p_spancmd = seq(
@@ -334,9 +408,8 @@ p_spancmd = seq(
 ############ show cdp neighbor grammar ##################
 
 p_platform = 'cisco' + Word(alphanums+'_-./')                  ('platform')
-p_capability = (
-        Empty() 
-        | 'Router'
+p_capability = ~L('Interface') + (
+        L('Router')
         | 'Switch'
         | 'IGMP'
         | Word(alphas+'_-.')
@@ -351,10 +424,10 @@ p_time = (
 p_iosversion = seq(
         'Cisco IOS Software',
         COMMA,
-        Word(alphas)                ('class'),
+        Word(alphanums)             ('class'),
         'Software',
         LPAR,
-        Word(printables)            ('build'),
+        Word(printables, excludeChars='()')  ('build'),
         RPAR,
         COMMA,
         'Version',
@@ -383,7 +456,7 @@ p_cdpneigh = seq(
             ))                                      ('ip_entries'),
 
         'Platform:', p_platform, COMMA,
-        'Capabilities: ', OneOrMore(p_capability)   ('capabilities'),
+        'Capabilities: ', ZeroOrMore(p_capability)  ('capabilities'),
 
         'Interface: ', p_interface, COMMA, 
         'Port ID (outgoing port):', p_interface,
@@ -406,6 +479,7 @@ p_cdpneigh = seq(
             + Word(alphanums+'-_/.')
             + White()
             + Word(nums+':.'))                      ('compilation_date'),
+        Optional(Suppress('by')),
         Word(alphanums+'_-.')                       ('compilation_team'),
 
         'advertisement version:',
@@ -415,7 +489,9 @@ p_cdpneigh = seq(
         'OUI=', p_hexliteral                        ('OUI'),
         COMMA,
         'Protocol ID=', p_hexliteral                ('protocol_id'),
+        Optional(Suppress(';')),
         'payload len=', Word(nums)                  ('payload_len'),
+        Optional(COMMA),
         'value=', p_hex                             ('value'),
 
         'VTP Management Domain:', 
@@ -519,45 +595,711 @@ p_cmd = OneOrMore(
 
 #################### end grammars ########################
 
-# TODO: if trace errors (parse fails), print input
+######################## records #########################
+
+# parsed commands are returned as these compact records rather
+# than pyparsing's ParseResults, which keep their token lists,
+# named result dicts and parent pointers alive for every hop
+
+class Record:
+    """
+    base of the parsed records, slotted, and compared and
+    printed by their fields
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        values = dict(zip(self.__slots__, args), **kwargs)
+        missing = [name for name in self.__slots__ if name not in values]
+        if missing or len(values) != len(self.__slots__):
+            raise TypeError(f'{type(self).__name__} takes the fields '
+                            f'{", ".join(self.__slots__)}')
+        for name in self.__slots__:
+            setattr(self, name, values[name])
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}'
+                           for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+class ArpEntry(Record):
+    """an entry of a `show ip arp vrf` table, age is None for '-'"""
+    __slots__ = ('protocol', 'ip', 'age', 'mac', 'type', 'interface')
+
+    @property
+    def vlan(self):
+        """vlan id of the entry's Vlan interface, or None"""
+        for prefix in ('Vlan', 'Vl'):
+            if self.interface.startswith(prefix):
+                return int(self.interface[len(prefix):])
+        return None
+
+
+class ArpTable(Record):
+    """a `show ip arp vrf` command run on host"""
+    __slots__ = ('host', 'vrf', 'entries')
+
+
+class Hop(Record):
+    """a hop of a `trace mac`"""
+    __slots__ = ('index', 'host', 'ip', 'inbridge', 'outbridge')
+
+
+class TraceMac(Record):
+    """
+    a `trace mac` command run on host, src_found and dest_found
+    are the switches the macs were found on, err is the error
+    message of a failed trace, or None
+    """
+    __slots__ = ('host', 'src_mac', 'dest_mac', 'vlan', 'src_found',
+                 'hops', 'dest_found', 'err')
+
+
+class CdpNeighbor(Record):
+    """
+    an entry of `show cdp neighbors detail`, interface is the
+    local one the neighbor was seen on, port is the neighbor's
+    """
+    __slots__ = ('device_id', 'ips', 'platform', 'capabilities',
+                 'interface', 'port', 'holdtime', 'native_vlan',
+                 'duplex', 'mgmt_ips')
+
+
+class StpPort(Record):
+    """an interface of a `show spanning-tree` vlan"""
+    __slots__ = ('interface', 'role', 'status', 'cost', 'priority',
+                 'number', 'type')
+
+
+class StpVlan(Record):
+    """
+    a vlan of `show spanning-tree`, root_port is the interface
+    towards the root bridge, None on the root bridge itself,
+    ports are its StpPorts
+    """
+    __slots__ = ('vlan', 'protocol', 'root_priority', 'root_mac',
+                 'root_cost', 'root_port', 'bridge_priority',
+                 'bridge_mac', 'ports')
+
+    @property
+    def isroot(self):
+        """whether the bridge is the vlan's root bridge"""
+        return self.bridge_mac == self.root_mac
+
+
+def arpentry(protocol, ip, age, mac, type_, interface):
+    """an ArpEntry from its parsed strings"""
+    return ArpEntry(protocol, IPv4Address.fromstr(ip),
+                    None if age == '-' else int(age),
+                    MACAddress.fromstr(mac), type_, interface)
+
+
+def hop(index, host, ip, inbridge, outbridge):
+    """a Hop from its parsed strings"""
+    return Hop(int(index), host, IPv4Address.fromstr(ip),
+               inbridge, outbridge)
+
+
+def tracemac(host, src, dest, vlan, src_found=None, hops=(),
+             dest_found=None, err=None):
+    """a TraceMac from its parsed strings"""
+    return TraceMac(host, MACAddress.fromstr(src), MACAddress.fromstr(dest),
+                    int(vlan), src_found, list(hops), dest_found, err)
+
+
+######################## end records #####################
+
+#################### fast path parser ########################
+
+# pyparsing spends most of a large log backtracking through the
+# alternatives of p_tracemac, so the usual shapes of `show ip arp vrf`
+# and `trace mac` output are parsed line by line with compiled regexes
+# instead. Blocks the fast path doesn't recognize are handed to the
+# grammars above, both produce the same records.
+
+r_hostname = r'[A-Za-z0-9_.-]+'
+r_mac = r'[0-9a-fA-F]+(?:\.[0-9a-fA-F]+)*'
+r_ip = r'[0-9]+(?:\.[0-9]+)*'
+r_port = (r'(?:Vlan[0-9]+|Vl[0-9]+|Po[0-9]+'
+          r'|(?:GigabitEthernet|Gi|Fa)[0-9]+/[0-9]+(?:/[0-9]+)?)')
+
+re_prompt = re.compile(rf'\s*({r_hostname})\s*#\s*(.*)')
+re_showip = re.compile(rf'show ip arp vrf\s+({r_hostname})\s*')
+re_arpheader = re.compile(
+    r'\s*Protocol\s+Address\s+Age \(min\)\s+Hardware Addr\s+Type\s+'
+    r'Interface\s*')
+re_entry = re.compile(
+    rf'\s*([A-Za-z]+)\s+({r_ip})\s+([0-9]+|-)\s+({r_mac})\s+([A-Za-z]+)\s+'
+    r'(Vlan[0-9]+|Vl[0-9]+|Port-channel[0-9]+\.[0-9]+)\s*')
+re_tracemac = re.compile(
+    rf'trace mac\s+({r_mac})\s+({r_mac})\s+vlan\s+([0-9]+)\s*')
+re_found = re.compile(
+    rf'\s*(Source|Destination)\s+({r_mac})\s+found on\s+({r_hostname})\s*')
+re_hop = re.compile(
+    rf'\s*([0-9]+)\s+({r_hostname})\s*\(\s*({r_ip})\s*\)\s*:\s*'
+    rf'({r_port})\s*=>\s*({r_port})\s*')
+re_completed = re.compile(r'\s*Layer 2 trace completed\s*')
+re_error = re.compile(r'\s*Error: (.*)')
+re_aborted = re.compile(r'\s*Layer\s*2\s*trace aborted\.\s*')
+re_samenbr = re.compile(
+    r'\s*(Source and Destination on same port and no nbr!)\s*')
+
+
+def split_blocks(log):
+    """
+    split a log into (line offset, block) pairs, each block
+    starting at a command prompt line
+    """
+    lines = log.split('\n')
+    start = 0
+    for i, line in enumerate(lines):
+        if i > start and re_prompt.match(line):
+            yield start, lines[start:i]
+            start = i
+    yield start, lines[start:]
+
+
+def fast_showip(host, asset, lines):
+    """`show ip arp vrf` body lines to an ArpTable, or None"""
+    if not lines or not re_arpheader.fullmatch(lines[0]):
+        return None
+    entries = []
+    for line in lines[1:]:
+        m = re_entry.fullmatch(line)
+        if m is None:
+            return None
+        entries.append(arpentry(*m.groups()))
+    if not entries:
+        return None
+    return ArpTable(host, asset, entries)
+
+
+def fast_tracemac(host, src, dest, vlan, lines):
+    """`trace mac` body lines to a TraceMac, or None"""
+    if not lines:
+        return None
+    m = re_samenbr.fullmatch(lines[0])
+    if m is not None:
+        if len(lines) != 1:
+            return None
+        return tracemac(host, src, dest, vlan, err=m.group(1))
+    m = re_error.fullmatch(lines[0])
+    if m is not None:
+        rest = lines[1:]
+        if rest and not (len(rest) == 1 and re_aborted.fullmatch(rest[0])):
+            return None
+        return tracemac(host, src, dest, vlan, err=m.group(1))
+    # Source, hops, Destination, completed, in that order
+    state = 'source'
+    src_found = dest_found = None
+    hops = []
+    for line in lines:
+        m = re_hop.fullmatch(line)
+        if m is not None and state in ('source', 'hops'):
+            hops.append(hop(*m.groups()))
+            state = 'hops'
+            continue
+        m = re_found.fullmatch(line)
+        if m is not None:
+            which, _, hostname = m.groups()
+            if which == 'Source' and state == 'source':
+                src_found = hostname
+                continue
+            if which == 'Destination' and state == 'hops':
+                dest_found = hostname
+                state = 'destination'
+                continue
+            return None
+        if re_completed.fullmatch(line) and state in ('hops', 'destination'):
+            state = 'completed'
+            continue
+        return None
+    if state != 'completed':
+        return None
+    return tracemac(host, src, dest, vlan, src_found, hops, dest_found)
+
+
+def fast_block(lines):
+    """
+    parse a block of lines starting at a prompt with the regex
+    fast path, None if it isn't a recognized shape
+    """
+    m = re_prompt.fullmatch(lines[0])
+    if m is None:
+        return None
+    host, cmdline = m.groups()
+    # blank lines are insignificant to the grammars too
+    body = [line for line in lines[1:] if line.strip()]
+    m = re_tracemac.fullmatch(cmdline)
+    if m is not None:
+        return fast_tracemac(host, *m.groups(), body)
+    m = re_showip.fullmatch(cmdline)
+    if m is not None:
+        return fast_showip(host, m.group(1), body)
+    return None
+
+
+def portname(tokens):
+    """
+    rejoin the tokens of a parsed port/interface, whose
+    slashes the grammar suppresses, e.g. Gi1/0/1
+    """
+    tokens = list(tokens)
+    return tokens[0] + '/'.join(tokens[1:])
+
+
+def found(parsed):
+    """the switch of a parsed optional `... found on` group"""
+    if not parsed:
+        return None
+    group, = parsed
+    return group['hostname']
+
+
+def parsed_to_cmd(parsed):
+    """
+    convert the pyparsing results of one p_showipcmd or
+    p_tracemac to an ArpTable or TraceMac
+    """
+    if parsed['cmd'] == 'show ip arp vrf':
+        return ArpTable(parsed['host'], parsed['asset'],
+                        [arpentry(e['protocol'], e['ip'], e['age'],
+                                  e['mac'], e['type'],
+                                  portname(e['interface']))
+                         for e in parsed['entries']])
+    return tracemac(parsed['host'], parsed['src_mac'], parsed['dest_mac'],
+                    parsed['vlan'], found(parsed.get('src_found')),
+                    (hop(h['index'], h['host'], h['ip'],
+                         portname(h['inbridge']), portname(h['outbridge']))
+                     for h in parsed.get('hops', [])),
+                    found(parsed.get('dest_found')), parsed.get('err'))
+
+
+processes = 1
+"""number of processes parse_log parses blocks in by default"""
+
+batchsize = 256
+"""number of blocks handed to a parsing process at once"""
+
+parsecache = None
+"""ParseCache parse_log reuses results from by default, None for none"""
+
+with open(__file__, 'rb') as source:
+    grammar_version = hashlib.sha256(source.read()).hexdigest()
+"""hash of this module, parse results cached by older versions
+of the grammars or records aren't reused"""
+
+# a block the fast path skipped may still be several commands
+# if a prompt wasn't at the start of a line
+p_block = OneOrMore(
+        (Group(p_showipcmd) | Group(p_tracemac))
+            .setName('show ip arp vrf or trace mac output'))
+
+
+FailedBlock = namedtuple('FailedBlock', ('offset', 'command', 'text', 'error'))
+FailedBlock.__doc__ = """
+a block of a log that couldn't be parsed, offset is its first
+line's 0-based offset in the log, command is the command its
+prompt ran, or None if it has no prompt
+"""
+
+
+def block_command(lines):
+    """the command a block's prompt ran, or None"""
+    m = re_prompt.fullmatch(lines[0])
+    return None if m is None else m.group(2).strip()
+
+
+def parse_blocks(blocks, fast=True, tolerant=False):
+    """
+    parse a list of (line offset, lines) blocks, each starting at
+    a prompt, into a list of ArpTables and TraceMacs and a list of
+    FailedBlocks. With fast, blocks are parsed by the regex fast
+    path, falling back to the pyparsing grammars for blocks it
+    doesn't recognize. Without tolerant, the first block that
+    fails raises its ParseException instead
+    """
+    cmds = []
+    failed = []
+    for offset, lines in blocks:
+        try:
+            cmd = fast_block(lines) if fast else None
+        except ValueError:
+            # let the grammars report the malformed mac or ip
+            cmd = None
+        if cmd is not None:
+            cmds.append(cmd)
+            continue
+        text = '\n'.join(lines)
+        try:
+            parsed = p_block.parseString(text, parseAll=True)
+            cmds.extend([parsed_to_cmd(p) for p in parsed])
+        except (ParseException, ValueError) as e:
+            # ValueErrors are malformed macs and ips
+            if not tolerant:
+                raise
+            failed.append(FailedBlock(
+                offset, block_command(lines), text, str(e)))
+    return cmds, failed
+
+
+def isshowip(lines):
+    """whether a block is a `show ip arp vrf` command"""
+    command = block_command(lines)
+    return command is not None and command.startswith('show ip arp vrf')
+
+
+def parse_log(log, fast=True, workers=None, tolerant=False, cache=None):
+    """
+    parse a log of `show ip arp vrf` and `trace mac` commands
+    into a list of ArpTables and TraceMacs, in order. With more than one
+    worker, batches of trace blocks are parsed in a process pool.
+    With tolerant, blocks that can't be parsed are skipped, and
+    a (commands, FailedBlocks) pair is returned instead. Results
+    are reused from, and stored in, cache, a ParseCache
+    """
+    if cache is None:
+        cache = parsecache
+    if cache is None:
+        return parse_log_blocks(log, fast, workers, tolerant)
+    # the fast path and the grammars give the same results
+    key = cache.key(grammar_version, 'tolerant' if tolerant else '', log)
+    result = cache.get(key)
+    if result is None:
+        result = parse_log_blocks(log, fast, workers, tolerant)
+        cache.put(key, result)
+    return result
+
+
+def parse_log_blocks(log, fast=True, workers=None, tolerant=False):
+    """parse_log, without its cache"""
+    if workers is None:
+        workers = processes
+    blocks = [(offset, lines) for offset, lines in split_blocks(log)
+              if any(line.strip() for line in lines)]
+    if workers <= 1 or len(blocks) <= batchsize:
+        cmds, failed = parse_blocks(blocks, fast, tolerant)
+        return (cmds, failed) if tolerant else cmds
+
+    with ProcessPoolExecutor(workers) as pool:
+        # arp tables are parsed here, in between submitting the
+        # traces that follow them, so mac to ip mappings are
+        # ready before the traces that need them
+        parts = []
+        batch = []
+        for block in blocks:
+            if isshowip(block[1]):
+                if batch:
+                    parts.append(pool.submit(
+                        parse_blocks, batch, fast, tolerant))
+                    batch = []
+                parts.append(parse_blocks([block], fast, tolerant))
+                continue
+            batch.append(block)
+            if len(batch) >= batchsize:
+                parts.append(pool.submit(parse_blocks, batch, fast, tolerant))
+                batch = []
+        if batch:
+            parts.append(pool.submit(parse_blocks, batch, fast, tolerant))
+
+        cmds = []
+        failed = []
+        for part in parts:
+            partcmds, partfailed = (
+                part.result() if isinstance(part, Future) else part)
+            cmds.extend(partcmds)
+            failed.extend(partfailed)
+        return (cmds, failed) if tolerant else cmds
+
+
+#################### cdp fast path ########################
+
+# `show cdp neighbors detail` entries are parsed field by field from
+# their "key: value" lines, ignoring the free form version text that
+# p_cdpneigh has to match exactly, so many devices' dumps can be
+# streamed through without holding more than an entry in memory
+
+re_cdpcmd = re.compile(r'sh(?:ow?)?\s+cdp\s+nei\w*\s+det\w*.*')
+re_cdpsep = re.compile(r'\s*-{5,}\s*')
+re_cdpdevice = re.compile(r'\s*Device ID:\s*(\S+)\s*')
+re_cdpaddrs = re.compile(r'\s*(Entry|Management) address\(es\):.*')
+re_cdpaddr = re.compile(r'\s*IP address:\s*(\S+)\s*')
+re_cdpplatform = re.compile(
+    r'\s*Platform:\s*(.*?)\s*,\s*Capabilities:\s*(.*?)\s*')
+re_cdpinterface = re.compile(
+    r'\s*Interface:\s*(\S+?)\s*,\s*Port ID \(outgoing port\):\s*(\S+)\s*')
+re_cdpholdtime = re.compile(r'\s*Holdtime\s*:\s*([0-9]+)\s*sec\s*')
+re_cdpvlan = re.compile(r'\s*Native VLAN:\s*([0-9]+)\s*')
+re_cdpduplex = re.compile(r'\s*Duplex:\s*(\S+)\s*')
+
+
+def cdp_entry(lines):
+    """
+    the lines of one `show cdp neighbors detail` entry to a
+    CdpNeighbor, or None if it lacks a device id or interfaces
+    """
+    fields = dict(device_id=None, ips=[], platform=None, capabilities=[],
+                  interface=None, port=None, holdtime=None,
+                  native_vlan=None, duplex=None, mgmt_ips=[])
+    addrs = fields['ips']
+    for line in lines:
+        m = re_cdpaddr.fullmatch(line)
+        if m is not None:
+            try:
+                addrs.append(IPv4Address.fromstr(m.group(1)))
+            except ValueError:
+                pass
+            continue
+        m = re_cdpaddrs.fullmatch(line)
+        if m is not None:
+            addrs = fields['ips' if m.group(1) == 'Entry' else 'mgmt_ips']
+            continue
+        m = re_cdpdevice.fullmatch(line)
+        if m is not None:
+            fields['device_id'] = m.group(1)
+            continue
+        m = re_cdpplatform.fullmatch(line)
+        if m is not None:
+            fields['platform'] = m.group(1)
+            fields['capabilities'] = m.group(2).split()
+            continue
+        m = re_cdpinterface.fullmatch(line)
+        if m is not None:
+            fields['interface'], fields['port'] = m.groups()
+            continue
+        m = re_cdpholdtime.fullmatch(line)
+        if m is not None:
+            fields['holdtime'] = int(m.group(1))
+            continue
+        m = re_cdpvlan.fullmatch(line)
+        if m is not None:
+            fields['native_vlan'] = int(m.group(1))
+            continue
+        m = re_cdpduplex.fullmatch(line)
+        if m is not None:
+            fields['duplex'] = m.group(1)
+    if None in (fields['device_id'], fields['interface'], fields['port']):
+        return None
+    return CdpNeighbor(**fields)
+
+
+def cdp_neighbors(lines, device=None):
+    """
+    stream (device, CdpNeighbor) pairs from the lines of a log of
+    `show cdp neighbors detail` commands, device is the one each
+    ran on, taken from its prompt, output before any prompt is
+    taken to be from device
+    """
+    incdp = True
+    entry = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        m = re_prompt.fullmatch(line)
+        if m is not None:
+            if entry:
+                neighbor = cdp_entry(entry)
+                if neighbor is not None:
+                    yield device, neighbor
+                entry = []
+            device = m.group(1)
+            incdp = re_cdpcmd.fullmatch(m.group(2).strip()) is not None
+            continue
+        if not incdp:
+            continue
+        if re_cdpsep.fullmatch(line):
+            if entry:
+                neighbor = cdp_entry(entry)
+                if neighbor is not None:
+                    yield device, neighbor
+            entry = []
+            continue
+        entry.append(line)
+    if entry:
+        neighbor = cdp_entry(entry)
+        if neighbor is not None:
+            yield device, neighbor
 
-def log_to_visioxml(traces, title=None):
-    """convert cisco trace mac output to a 
-    visio-structured XML doc"""
+
+#################### spanning tree fast path ########################
+
+# `show spanning-tree` vlans are parsed line by line the same way,
+# keeping only what the forwarding trees need, the root and bridge
+# ids, the root port and each interface's role, state and cost
+
+re_stpcmd = re.compile(r'sh(?:ow?)?\s+span\w*-?\w*(?:\s+vlan\s+\S+)?\s*')
+re_stpvlan = re.compile(r'\s*VLAN0*([0-9]+)\s*')
+re_stpprotocol = re.compile(
+    r'\s*Spanning tree enabled protocol\s+(\S+)\s*')
+re_stpid = re.compile(r'\s*(Root|Bridge) ID\s+Priority\s+([0-9]+).*')
+re_stpaddress = re.compile(rf'\s*Address\s+({r_mac})\s*')
+re_stpcost = re.compile(r'\s*Cost\s+([0-9]+)\s*')
+re_stpinterface = re.compile(
+    r'\s*(\S+)\s+(Root|Desg|Altn|Back|Mstr|Disb)\s+'
+    r'(FWD|BLK|LRN|LIS|BKN|DIS)\s+([0-9]+)\s+([0-9]+)\.([0-9]+)'
+    r'\s+(.*?)\s*')
+
+
+def stp_vlan(lines):
+    """
+    the lines of one `show spanning-tree` vlan, from its VLAN
+    line, to an StpVlan, or None if it lacks a root or bridge id
+    """
+    fields = dict(vlan=None, protocol=None, root_priority=None,
+                  root_mac=None, root_cost=0, root_port=None,
+                  bridge_priority=None, bridge_mac=None, ports=[])
+    section = None
+    for line in lines:
+        m = re_stpinterface.fullmatch(line)
+        if m is not None:
+            interface, role, status, cost, priority, number, type_ = \
+                    m.groups()
+            fields['ports'].append(StpPort(
+                    interface, role, status, int(cost), int(priority),
+                    int(number), type_))
+            if role == 'Root':
+                fields['root_port'] = interface
+            continue
+        m = re_stpvlan.fullmatch(line)
+        if m is not None:
+            fields['vlan'] = int(m.group(1))
+            continue
+        m = re_stpprotocol.fullmatch(line)
+        if m is not None:
+            fields['protocol'] = m.group(1)
+            continue
+        m = re_stpid.fullmatch(line)
+        if m is not None:
+            section = m.group(1).lower()
+            fields[f'{section}_priority'] = int(m.group(2))
+            continue
+        m = re_stpaddress.fullmatch(line)
+        if m is not None and section is not None:
+            try:
+                fields[f'{section}_mac'] = MACAddress.fromstr(m.group(1))
+            except ValueError:
+                pass
+            continue
+        m = re_stpcost.fullmatch(line)
+        if m is not None and section == 'root':
+            fields['root_cost'] = int(m.group(1))
+    if None in (fields['vlan'], fields['root_mac'], fields['bridge_mac']):
+        return None
+    return StpVlan(**fields)
+
+
+def stp_vlans(lines, device=None):
+    """
+    stream (device, StpVlan) pairs from the lines of a log of
+    `show spanning-tree` commands, device is the one each ran
+    on, taken from its prompt, output before any prompt is
+    taken to be from device
+    """
+    instp = True
+    vlan = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        m = re_prompt.fullmatch(line)
+        if m is not None:
+            if vlan:
+                parsed = stp_vlan(vlan)
+                if parsed is not None:
+                    yield device, parsed
+                vlan = []
+            device = m.group(1)
+            instp = re_stpcmd.fullmatch(m.group(2).strip()) is not None
+            continue
+        if not instp:
+            continue
+        if re_stpvlan.fullmatch(line):
+            if vlan:
+                parsed = stp_vlan(vlan)
+                if parsed is not None:
+                    yield device, parsed
+            vlan = []
+        vlan.append(line)
+    if vlan:
+        parsed = stp_vlan(vlan)
+        if parsed is not None:
+            yield device, parsed
+
+
+def log_to_networks(traces, title=None, fast=True, workers=None,
+                    failed=None, cache=None):
+    """convert cisco trace mac output to the in memory
+    structure of a visio-structured XML doc, as xmltodict
+    would parse it, for visio and sheet to use directly,
+    if a failed list is given, blocks that can't be parsed
+    are skipped and appended to it as FailedBlocks instead
+    of raising, each vrf of each router is its own network,
+    named vrf_router, or title_vrf_router if a title is given"""
 
     # cisco router log excerpts on whatsup generally have the
     # procedural exhaustive equivalent structure to:
     # $ show ip && for mac in $(show ip); do trace mac "$mac"; done
-    parsed = p_cmd.parseString(traces, parseAll=True)
-    # need to check PEP8 for that one...
-
-    if title is None:
-        title = parsed['show_ip']['asset']
-
-    # map macs to ips to prevent future linear searches
-    mac_to_ip = {}
-    for entry in parsed['show_ip']['entries']:
-        if entry['mac'] in mac_to_ip:
-            mac_to_ip[entry['mac']].append(entry['ip'])
-        else:
-            mac_to_ip[entry['mac']] = [entry['ip']]
+    # repeated for any number of vrfs and routers, each arp table
+    # scoping the traces its router runs after it
+    if failed is None:
+        cmds = parse_log(traces, fast, workers, cache=cache)
+    else:
+        cmds, skipped = parse_log(traces, fast, workers, True, cache)
+        failed.extend(skipped)
 
     # construct XML (that's what all the
     # list and odict composition is)
     xml = odict()
     xml['networks'] = odict()
     xml['networks']['network'] = []
-    thisnet = odict()
-    xml['networks']['network'].append(thisnet)
-
-    thisnet['networkname'] = f'{title}_{parsed["host"]}'
-    thisnet['hosts'] = odict()
-    thisnet['hosts']['host'] = []
 
-    for trace in parsed['traces']:
+    # (vrf, router) to its network, and to its mac to ip map,
+    # kept across repeated arp tables
+    networks = {}
+    mac_to_ips = {}
+    # router to the network and mac to ip map its traces go to
+    scope = {}
+
+    for cmd in cmds:
+
+        if isinstance(cmd, ArpTable):
+            thisnet = networks.get((cmd.vrf, cmd.host))
+            if thisnet is None:
+                name = cmd.vrf if title is None else f'{title}_{cmd.vrf}'
+                thisnet = odict()
+                thisnet['networkname'] = f'{name}_{cmd.host}'
+                thisnet['hosts'] = odict()
+                thisnet['hosts']['host'] = []
+                xml['networks']['network'].append(thisnet)
+                networks[(cmd.vrf, cmd.host)] = thisnet
+            # map macs to ips to prevent future linear searches
+            mac_to_ip = mac_to_ips.setdefault((cmd.vrf, cmd.host), {})
+            for entry in cmd.entries:
+                if entry.mac in mac_to_ip:
+                    mac_to_ip[entry.mac].append(str(entry.ip))
+                else:
+                    mac_to_ip[entry.mac] = [str(entry.ip)]
+            scope[cmd.host] = (thisnet, mac_to_ip)
+            continue
 
+        trace = cmd
         # disregard error traces
-        if 'err' in trace:
+        if trace.err is not None:
+            continue
+        if trace.host not in scope:
+            # the arp table might have been skipped when tolerant
+            if failed is not None:
+                continue
+            raise Exception(f'trace mac on {trace.host} before any '
+                            f'show ip arp vrf')
+        thisnet, mac_to_ip = scope[trace.host]
+        if failed is not None and trace.dest_mac not in mac_to_ip:
             continue
 
         host = odict()
@@ -565,25 +1307,57 @@ def log_to_visioxml(traces, title=None):
 
         # set host data
         # if there are multiple addresses, use them as one name
-        host['hostname'] = ','.join(mac_to_ip[trace['dest_mac']])
-        host['address'] = ','.join(mac_to_ip[trace['dest_mac']])
+        host['hostname'] = ','.join(mac_to_ip[trace.dest_mac])
+        host['address'] = ','.join(mac_to_ip[trace.dest_mac])
 
         host['trace'] = odict()
         host['trace']['hop'] = []
 
         # go through hops
-        for hop in trace['hops']:  # NOTE: used to skip hop 1
+        for hop in trace.hops:  # NOTE: used to skip hop 1
             host['trace']['hop'].append(
                     odict(
-                        index=int(hop['index']), 
-                        hostname=hop['host'], 
-                        address=hop['ip']))
+                        index=hop.index, 
+                        hostname=hop.host, 
+                        address=str(hop.ip)))
+
+    if not networks:
+        raise Exception('No show ip arp vrf output in log')
 
-    return xmldump(xml, pretty=True)
+    return xml
+
+
+def log_to_visioxml(traces, title=None, fast=True, workers=None,
+                    failed=None, cache=None):
+    """convert cisco trace mac output to a 
+    visio-structured XML doc, see log_to_networks"""
+    return xmldump(log_to_networks(traces, title, fast, workers,
+                                   failed, cache), pretty=True)
 
 
 if __name__ == '__main__':
-    from sys import stdin
-    print(log_to_visioxml(stdin.read()))
+    from sys import stdin, stderr
+    p = argparse.ArgumentParser(
+            description='convert a cisco trace mac log to xml for visio')
+    p.add_argument('-t', '--title', default=None,
+            help='prefix of the network names, vrf_router by default')
+    p.add_argument('-P', '--pyparsing', action='store_true',
+            help='parse only with the pyparsing grammars, '
+            'skipping the regex fast path')
+    p.add_argument('-j', '--jobs', type=int, default=processes,
+            help='number of processes to parse trace blocks in')
+    p.add_argument('-k', '--keep-going', action='store_true',
+            help='skip blocks that can\'t be parsed, listing them '
+            'on stderr, instead of failing')
+    p.add_argument('-C', '--cache', default=None,
+            help='path of an on-disk cache of parsed logs to reuse')
+    args = p.parse_args()
+    failed = [] if args.keep_going else None
+    cache = None if args.cache is None else ParseCache(args.cache)
+    print(log_to_visioxml(stdin.read(), args.title, not args.pyparsing,
+                          args.jobs, failed, cache))
+    for block in failed or ():
+        print(f'line {block.offset + 1}: could not parse '
+              f'{block.command!r}: {block.error}', file=stderr)
 
 
@@ -1,26 +1,19 @@
 
-from netaddr import IPSet, IPNetwork
-from trace import IPFile
+from trace import IPFile, range_cidrs
 import json
 
-IPSet.__invert__ = lambda s : IPSet(IPNetwork('0.0.0.0/0')) - s
-
 i = IPFile()
 i.fromfile('private/REDACTED.ips')
 
-t = json(open('REDACTED', 'r').read())
+t = json.loads(open('REDACTED', 'r').read())
 
 t['exclude'].clear()
 t['exclude'].append('192.168.1.0/24')
 
+# a single sweep over the sorted intervals of the ips file
+compl = i.complement()
 
-compl = IPSet(IPNetwork('0.0.0.0/0'))
-for ip in i:
-    compl = compl & ~IPSet(IPNetwork(ip))
-
-compl.compact()
-
-t['exclude'].extend( (str(i) for i in compl.iter_cidrs()) )
+t['exclude'].extend(c for start, end in compl for c in range_cidrs(start, end))
 
 with open('REDACTED2', 'w') as f:
     f.write(json.dumps(t))
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+"""
+An asynchronous UDP traceroute engine, an alternative to nmap's
+--traceroute for trace.py, that uses the Doubletree redundancy
+reduction technique.
+
+Each destination is probed forward from a starting hop distance until
+it is reached, then backward toward the scanner. Every interface seen
+at a hop distance is added to a stop set of (interface, ttl) pairs
+shared by all traces, and backward probing stops as soon as it hits
+an interface already in it, since the rest of the path toward the
+scanner was already discovered by another trace. Those hops are then
+copied from that trace, so every destination still gets its full
+hop list.
+
+Probes are unprivileged, ICMP errors are read from the socket error
+queue with IP_RECVERR, so this only works on Linux.
+
+CLI USAGE:
+
+    ./doubletree.py 10.0.0.1 10.0.0.2 ...
+
+PYTHON USAGE:
+    >>> for dest, hostname, hops in Doubletree().run(dests):
+    ...     for ttl, address, name in hops: ...
+"""
+
+__author__ = 'Michael Belousov'
+
+import asyncio
+import socket
+import struct
+import argparse
+
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+SO_EE_ORIGIN_ICMP = 2
+ICMP_DEST_UNREACH = 3
+ICMP_PORT_UNREACH = 3
+"""linux socket error queue constants"""
+
+sock_extended_err = struct.Struct('=IBBBBII')
+"""linux struct sock_extended_err, followed by the offender's sockaddr_in"""
+
+baseport = 33434
+"""first destination port of probes, the ttl is added to it"""
+
+timeout = 1.0
+"""seconds to wait for the response to a probe"""
+
+maxhops = 30
+"""maximum ttl probed"""
+
+starthop = 3
+"""ttl the forward probing of each destination starts at"""
+
+gaplimit = 3
+"""consecutive unresponsive hops before forward probing gives up"""
+
+concurrency = 64
+"""maximum number of destinations traced at once"""
+
+
+def classify(dest, offender, icmptype, code):
+    """
+    (reached, unreachable) of an ICMP error to a probe of dest,
+    only dest itself refuses the probe's port, other unreachables
+    can come from any router on the way, which can't forward to it
+    """
+    if icmptype != ICMP_DEST_UNREACH:
+        return False, False
+    reached = offender == dest or code == ICMP_PORT_UNREACH
+    return reached, not reached
+
+
+async def probe(dest, ttl, wait=timeout):
+    """
+    send a single UDP probe, returns the responding address, or
+    None on timeout, whether the response came from dest, and
+    whether a hop reported dest unreachable, e.g. a router's host
+    or admin prohibited unreachable, so the path ends at that hop
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.setsockopt(socket.SOL_IP, IP_RECVERR, 1)
+    sock.setsockopt(socket.SOL_IP, socket.IP_TTL, ttl)
+    response = loop.create_future()
+
+    def onready():
+        if response.done():
+            return
+        try:
+            _, ancdata, _, _ = sock.recvmsg(0, 512, socket.MSG_ERRQUEUE)
+        except BlockingIOError:
+            # not an error, the destination answered the probe itself
+            try:
+                _, (addr, _) = sock.recvfrom(512)
+                response.set_result((addr, True, False))
+            except BlockingIOError:
+                pass
+            return
+        for level, type_, data in ancdata:
+            if level != socket.SOL_IP or type_ != IP_RECVERR:
+                continue
+            _, origin, icmptype, code, _, _, _ = \
+                    sock_extended_err.unpack_from(data)
+            if origin != SO_EE_ORIGIN_ICMP:
+                continue
+            # offender sockaddr_in: family, port, address
+            offset = sock_extended_err.size + 4
+            addr = socket.inet_ntoa(data[offset:offset + 4])
+            response.set_result((addr, *classify(dest, addr, icmptype, code)))
+            return
+
+    loop.add_reader(sock.fileno(), onready)
+    try:
+        sock.sendto(b'\0' * 32, (dest, baseport + ttl))
+        return await asyncio.wait_for(response, wait)
+    except asyncio.TimeoutError:
+        return None, False, False
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+
+class Path:
+    """the hops found by probing one destination"""
+    __slots__ = ('dest', 'hops', 'borrowed', 'reached')
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.hops = {}
+        """ttl to interface address of the probed hops"""
+        self.borrowed = None
+        """(path, ttl), hops below ttl are the same as that path's"""
+        self.reached = False
+
+
+class Doubletree:
+    """
+    traces many destinations, sharing a stop set of (interface, ttl)
+    pairs between them so their common hops are only probed once
+    """
+    def __init__(self, starthop=None, maxhops=None, gaplimit=None,
+                 timeout=None, concurrency=None, resolve=True):
+        """unset options default to the module level attributes"""
+        module = globals()
+        option = lambda name, value: module[name] if value is None else value
+        self.maxhops = option('maxhops', maxhops)
+        self.starthop = min(option('starthop', starthop), self.maxhops)
+        self.gaplimit = option('gaplimit', gaplimit)
+        self.timeout = option('timeout', timeout)
+        self.concurrency = option('concurrency', concurrency)
+        self.resolve = resolve
+        self.stopset = {}
+        """(interface, ttl) to the path that first probed it"""
+        self.probes = 0
+        """number of probes sent"""
+
+    async def probe(self, path, ttl):
+        self.probes += 1
+        addr, reached, unreachable = await probe(path.dest, ttl, self.timeout)
+        if addr is not None and not reached:
+            path.hops[ttl] = addr
+            self.stopset.setdefault((addr, ttl), path)
+        return addr, reached, unreachable
+
+    async def trace(self, dest):
+        """probe dest forward from starthop, then backward to the stop set"""
+        path = Path(dest)
+        # forward
+        gap = 0
+        for ttl in range(self.starthop, self.maxhops + 1):
+            addr, reached, unreachable = await self.probe(path, ttl)
+            if reached:
+                path.hops[ttl] = addr
+                path.reached = True
+                break
+            if unreachable:
+                # a router on the way can't forward to dest
+                break
+            gap = 0 if addr is not None else gap + 1
+            if gap >= self.gaplimit:
+                break
+        # backward
+        for ttl in range(self.starthop - 1, 0, -1):
+            addr, reached, _ = await self.probe(path, ttl)
+            if reached:
+                # the destination is closer than the starting hop
+                path.hops = {t: a for t, a in path.hops.items() if t < ttl}
+                path.hops[ttl] = addr
+                continue
+            if addr is None:
+                continue
+            first = self.stopset[(addr, ttl)]
+            if first is not path:
+                path.borrowed = (first, ttl)
+                break
+        return path
+
+    def hops(self, path):
+        """sorted (ttl, address) hops of a path, including borrowed ones"""
+        hops = dict(path.hops)
+        if path.borrowed is not None:
+            other, below = path.borrowed
+            for ttl, addr in self.hops(other):
+                if ttl < below:
+                    hops.setdefault(ttl, addr)
+        return sorted(hops.items())
+
+    async def names(self, addrs):
+        """reverse dns names of addresses, None where there is none"""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def lookup(addr):
+            async with semaphore:
+                try:
+                    name, _ = await loop.getnameinfo(
+                            (addr, 0), socket.NI_NAMEREQD)
+                    return addr, name
+                except (socket.gaierror, socket.herror):
+                    return addr, None
+        return dict(await asyncio.gather(*(lookup(a) for a in addrs)))
+
+    async def traceall(self, dests):
+        dests = iter(dests)
+        paths = []
+        async def worker():
+            for dest in dests:
+                paths.append(await self.trace(dest))
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        hops = [(path, self.hops(path)) for path in paths]
+        names = {}
+        if self.resolve:
+            addrs = {a for _, h in hops for _, a in h}
+            addrs.update(path.dest for path in paths)
+            names = await self.names(addrs)
+        return [(path.dest,
+                 names.get(path.dest),
+                 [(ttl, addr, names.get(addr)) for ttl, addr in h])
+                for path, h in hops]
+
+    def run(self, dests):
+        """
+        trace every destination, returns a list of
+        (destination, hostname, [(ttl, address, hostname), ...])
+        """
+        return asyncio.run(self.traceall(dests))
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description='Doubletree traceroute of many destinations')
+    p.add_argument('-s', '--start-hop', type=int, default=starthop,
+        help='ttl forward probing starts at')
+    p.add_argument('-m', '--max-hops', type=int, default=maxhops,
+        help='maximum ttl probed')
+    p.add_argument('-j', '--concurrency', type=int, default=concurrency,
+        help='maximum number of destinations traced at once')
+    p.add_argument('-n', '--no-resolve', action='store_true',
+        help='do not look up hop hostnames')
+    p.add_argument('dests', nargs='+', help='addresses to trace')
+    args = p.parse_args()
+
+    engine = Doubletree(args.start_hop, args.max_hops,
+                        concurrency=args.concurrency,
+                        resolve=not args.no_resolve)
+    for dest, hostname, hops in engine.run(args.dests):
+        print(f'{dest} ({hostname})')
+        for ttl, addr, name in hops:
+            print(f'  {ttl} {name or addr} ({addr})')
+    print(f'{engine.probes} probes sent')
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+An in-process fake of a cisco IOS router and its netmiko
+connections, no SSH involved, answering `show ip arp vrf` and
+`trace mac` with synthlog.py's synthetic output after a
+configurable latency, so batch_cisco_mactrace.py can be exercised
+and timed without a router.
+
+Sessions have the parts of netmiko's connection interface the
+batch scripts use, send_command, and write_channel and
+read_channel for pipelining, and refuse to run two commands at
+once through send_command, as a real channel would garble them.
+
+CLI USAGE:
+
+    ./batch_cisco_mactrace.py --fake 200 -j 8 VRF1 VRF2
+
+PYTHON USAGE:
+    >>> router = FakeRouter('rtr1', {'VRF1': 200}, latency=0.5)
+    >>> with router.connect() as ssh:
+    ...     print(ssh.send_command('show ip arp vrf VRF1'))
+"""
+
+__author__ = 'Michael Belousov'
+
+import io
+import random
+import re
+import threading
+import time
+import synthlog
+
+re_showip = re.compile(r'show ip arp vrf\s+(\S+)\s*')
+re_tracemac = re.compile(
+        r'trace mac\s+(\S+)\s+(\S+)\s+vlan\s+([0-9]+)\s*')
+
+
+class FakeRouter:
+    """
+    a synthetic router, vrfs maps each vrf to its number of hosts,
+    every errors'th trace fails, latency is the seconds each
+    command takes, rtt the seconds of a round trip to the router,
+    and flaky the fraction of trace outputs cut off halfway, as
+    netmiko sometimes returns them
+    """
+    def __init__(self, hostname='rtr1', vrfs={'VRF1': 100}, latency=0.0,
+                 errors=10, rtt=0.0, flaky=0.0, seed=0):
+        self.hostname = hostname
+        self.latency = latency
+        self.errors = errors
+        self.rtt = rtt
+        self.flaky = flaky
+        self.rand = random.Random(seed)
+        self.vrfs = {}
+        """vrf to its (hosts, vlan, first mac number)"""
+        first = 1
+        for i, (vrf, hosts) in enumerate(vrfs.items()):
+            self.vrfs[vrf] = (hosts, 100 + i, first)
+            # leave room for the next vrf's root entry
+            first += hosts + 1
+        self.sessions = 0
+        """number of sessions open"""
+        self.maxsessions = 0
+        """most sessions that were open at once"""
+        self.commands = []
+        """every command run, in the order they were run"""
+        self.lock = threading.Lock()
+
+    def connect(self, **kwargs):
+        """open a FakeSession, taking the same options as netmiko"""
+        with self.lock:
+            self.sessions += 1
+            self.maxsessions = max(self.maxsessions, self.sessions)
+        return FakeSession(self)
+
+    def output(self, cmd):
+        """the output of cmd, without its echo and the next prompt"""
+        f = io.StringIO()
+        m = re_showip.fullmatch(cmd)
+        if m is not None:
+            if m.group(1) not in self.vrfs:
+                return f'% VRF {m.group(1)} does not exist\n'
+            hosts, vlan, first = self.vrfs[m.group(1)]
+            synthlog.write_arp_output(f, hosts, vlan, first)
+            return f.getvalue()
+        m = re_tracemac.fullmatch(cmd)
+        if m is not None:
+            src, dst, vlan = m.groups()
+            i = int(dst.replace('.', ''), 16)
+            result = 'error' if self.errors and i % self.errors == 0 \
+                     else 'completed'
+            synthlog.write_trace_output(f, src, i, result)
+            with self.lock:
+                cut = self.rand.random() < self.flaky
+            if cut:
+                lines = f.getvalue().split('\n')
+                return '\n'.join(lines[:len(lines) // 2]) + '\n'
+            return f.getvalue()
+        return ''
+
+
+class FakeSession:
+    """a netmiko-like session to a FakeRouter"""
+    def __init__(self, router):
+        self.router = router
+        self.busy = threading.Lock()
+        self.open = True
+        self.RETURN = '\n'
+        self.pending = []
+        """(time it's read, echo and output) of written commands"""
+        self.typed = ''
+        self.busy_until = 0.0
+        """time the router finishes the commands written so far"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.disconnect()
+
+    def disconnect(self):
+        if self.open:
+            self.open = False
+            with self.router.lock:
+                self.router.sessions -= 1
+
+    def find_prompt(self):
+        time.sleep(self.router.rtt)
+        return f'{self.router.hostname}#'
+
+    def send_command(self, cmd, **kwargs):
+        """
+        run cmd, returns its output followed by the next prompt,
+        which output_as_cmd expects
+        """
+        if not self.open:
+            raise Exception('session is closed')
+        if not self.busy.acquire(blocking=False):
+            raise Exception('session is already running a command')
+        try:
+            with self.router.lock:
+                self.router.commands.append(cmd)
+            time.sleep(self.router.rtt + self.router.latency)
+            return self.router.output(cmd) + f'{self.router.hostname}#'
+        finally:
+            self.busy.release()
+
+    def write_channel(self, text):
+        """
+        type text at the prompt, each line's command runs after
+        the ones before it, without waiting for them to be read
+        """
+        self.typed += text
+        *lines, self.typed = self.typed.split('\n')
+        for cmd in lines:
+            cmd = cmd.strip()
+            with self.router.lock:
+                self.router.commands.append(cmd)
+            # commands run one after the other once they arrive
+            self.busy_until = self.router.latency + max(
+                    self.busy_until, time.monotonic() + self.router.rtt / 2)
+            self.pending.append(
+                (self.busy_until + self.router.rtt / 2,
+                 f'{cmd}\r\n{self.router.output(cmd)}'
+                 f'{self.router.hostname}#'))
+
+    def read_channel(self):
+        """whatever the commands written have output so far"""
+        now = time.monotonic()
+        text = ''
+        while self.pending and self.pending[0][0] <= now:
+            text += self.pending.pop(0)[1]
+        return text
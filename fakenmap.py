@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""
+A local stand-in for nmap, taking the arguments trace.py runs it
+with and writing an nmap style xml log in which every target is
+traced through a single gateway, so trace.py and run.py can be
+exercised without scanning a network.
+
+Targets listed with --down don't respond, a host discovery sweep
+(no --traceroute) logs them as down, and a traceroute scan logs
+them without a trace, as nmap does with -Pn. With --delay, each
+host is flushed to the log that many seconds after the one before
+it, like a long running scan being followed.
+
+CLI USAGE:
+
+    ./fakenmap.py --down 10.0.0.3 -sn -Pn --traceroute \
+            -oX nmap_log.xml -iL hosts.txt
+
+PYTHON USAGE:
+    >>> trace.nmapcmd = fakenmap.command(down=['10.0.0.3'])
+    >>> trace.discoverycmd = fakenmap.command(discovery=True)
+"""
+
+__author__ = 'Michael Belousov'
+
+import argparse
+import os
+import sys
+import time
+from netaddr import IPSet
+
+gateway = '10.255.0.1'
+"""the hop every fake trace goes through"""
+
+header = ('<?xml version="1.0"?>\n<!DOCTYPE nmaprun>\n'
+          '<nmaprun scanner="nmap" args="{}">\n')
+"""opening of a log, formatted with the arguments"""
+
+footer = '<runstats><finished time="1"/></runstats>\n</nmaprun>\n'
+"""closing of a log"""
+
+
+def command(down=(), delay=0.0, discovery=False):
+    """a trace.py nmap command running this fake instead, see
+    trace.nmapcmd and trace.discoverycmd"""
+    cmd = [sys.executable, os.path.abspath(__file__), '--delay', str(delay)]
+    if down:
+        cmd += ['--down', *down]
+    if not discovery:
+        cmd.append('--traceroute')
+    return cmd
+
+
+def expand(listpath):
+    """the addresses and names of an nmap input list"""
+    targets = []
+    with open(listpath) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                targets.extend(str(addr) for addr in IPSet([line]))
+            except Exception:
+                targets.append(line)
+    return targets
+
+
+def hostxml(addr, up, traced):
+    """the log's <host> element of addr"""
+    status = '<status state="{}" reason="user-set"/>'.format(
+            'up' if up else 'down')
+    trace = ''
+    if traced:
+        trace = ('<trace port="80" proto="tcp">'
+                 '<hop ttl="1" ipaddr="{}" rtt="1" host="gw"/>'
+                 '<hop ttl="2" ipaddr="{}" rtt="2"/></trace>').format(
+                         gateway, addr)
+    return ('<host>{}<address addr="{}" addrtype="ipv4"/><hostnames/>'
+            '{}</host>\n').format(status, addr, trace)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+            description='a stand-in for nmap, see docstrings',
+            allow_abbrev=False)
+    p.add_argument('--down', nargs='+', default=[],
+                   help='targets that don\'t respond')
+    p.add_argument('--delay', type=float, default=0.0,
+                   help='seconds between each host logged')
+    p.add_argument('--traceroute', action='store_true')
+    p.add_argument('-oX', dest='output', required=True)
+    p.add_argument('-iL', dest='input', required=True)
+    p.add_argument('--excludefile', default=None)
+    args, _ = p.parse_known_args(argv)
+
+    targets = expand(args.input)
+    if args.excludefile is not None:
+        excluded = set(expand(args.excludefile))
+        targets = [t for t in targets if t not in excluded]
+    down = set(args.down)
+    with open(args.output, 'w') as f:
+        f.write(header.format(' '.join(sys.argv)))
+        for addr in targets:
+            up = addr not in down
+            if args.traceroute:
+                # -Pn, every target is logged, only live ones traced
+                f.write(hostxml(addr, True, up))
+            else:
+                f.write(hostxml(addr, up, False))
+            f.flush()
+            time.sleep(args.delay)
+        f.write(footer)
+
+
+if __name__ == '__main__':
+    main()
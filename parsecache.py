@@ -0,0 +1,120 @@
+"""
+A persistent, on-disk cache of parsed logs, so reports rebuilt over
+the same archived logs don't pay for parsing them again. Results
+are stored pickled and zlib compressed in a SQLite table, keyed by
+a hash of the log and everything else the result depends on, e.g.
+the parser's version, and the least recently used are evicted once
+the cache outgrows its size bound.
+
+PYTHON USAGE:
+    >>> cache = ParseCache('parse_cache.sqlite', maxsize=256 * 2**20)
+    >>> key = cache.key(version, log)
+    >>> result = cache.get(key)
+    >>> if result is None:
+    ...     result = parse(log)
+    ...     cache.put(key, result)
+"""
+
+__author__ = 'Michael Belousov'
+
+import sqlite3
+import hashlib
+import pickle
+import zlib
+import time
+import threading
+
+default_maxsize = 256 * 2**20
+"""bytes of compressed results the cache keeps"""
+
+schema = '''
+    CREATE TABLE IF NOT EXISTS results (
+        key         TEXT PRIMARY KEY,
+        data        BLOB,
+        size        INTEGER,
+        used        REAL
+    )'''
+"""table of results, data is a compressed pickle, used a timestamp"""
+
+
+class ParseCache:
+    """
+    SQLite backed, size bounded, least recently used cache of
+    parse results, keyed by content hashes, shareable between threads
+    """
+    def __init__(self, dbpath, maxsize=default_maxsize):
+        self.maxsize = maxsize
+        # reentrant, put evicts while holding it
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(dbpath, check_same_thread=False)
+        self.db.execute(schema)
+        self.db.execute(
+                'CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    @staticmethod
+    def key(*parts):
+        """hash of parts, strings or bytes, e.g. a version and a log"""
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            # length prefixed so parts can't run into each other
+            h.update(len(part).to_bytes(8, 'little'))
+            h.update(part)
+        return h.hexdigest()
+
+    def get(self, key, now=None):
+        """the result stored under key, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT data FROM results WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE results SET used = ? WHERE key = ?',
+                            (time.time() if now is None else now, key))
+            self.db.commit()
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key, result, now=None):
+        """store result under key, evicting old results if needed"""
+        data = zlib.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        if len(data) > self.maxsize:
+            return
+        with self.lock:
+            self.db.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                    (key, data, len(data),
+                     time.time() if now is None else now))
+            self.evict()
+
+    def size(self):
+        """bytes of compressed results stored"""
+        with self.lock:
+            return self.db.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def evict(self):
+        """delete least recently used results down to maxsize"""
+        with self.lock:
+            excess = self.size() - self.maxsize
+            cursor = self.db.execute(
+                    'SELECT key, size FROM results ORDER BY used')
+            stale = []
+            for key, size in cursor:
+                if excess <= 0:
+                    break
+                stale.append((key,))
+                excess -= size
+            self.db.executemany('DELETE FROM results WHERE key = ?', stale)
+            self.db.commit()
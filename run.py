@@ -12,6 +12,13 @@ OPTIONS
     -k/--keep-scan-logs
                     don't delete the nmap scan xml logs used to generate the final product
 
+    -f/--hostsfile FILE
+                    file of the ip groups to scan, trace.py's targetfile by default
+
+    -p/--progress SECONDS
+                    while scanning, refresh a partial trace.xml, csv and svgs every
+                    SECONDS, so results of long scans can be looked at early
+
 
 TODO
     - finish proper implementation of command line execution options, e.g. don't rerun trace
@@ -23,17 +30,40 @@ AUTHOR
 """
 
 import argparse
-import trace, visio, hosttypes, sheet
+import os
+import trace, visio, sheet
+
+def refresh(xmlpath):
+    """regenerate the csv and svgs from a (partial) trace.xml"""
+    xml = open(xmlpath, 'rb').read()
+    sheet.run(xml)
+    return visio.run(xml, trace.root_dir)
 
 def run(target, 
         do_scan=True, 
         keep_logs=False,
-        email=False):
-    trace.run(do_scan, keep_logs)
-    hosttypes.run()
-    sheet.run()
-    visio.run()  # should return a file path to the produced svg?
-    # get result
+        email=False,
+        progress=None):
+    """
+    scan target, an IPFile or the path of an *.ips file, by
+    default trace.targetfile, then graph the result, returns
+    the svg file names, visio chooses the host icons with hosttype
+    """
+    if target is None:
+        target = trace.targetfile
+    if isinstance(target, str):
+        iplist = trace.IPFile()
+        iplist.fromfile(target)
+        target = iplist
+    trace.iplist = target
+    # the partial results are written to resultpath while scanning,
+    # so the final one replaces it once it's complete
+    final = trace.resultpath + '.part'
+    with open(final, 'w') as output:
+        trace.run(do_scan, keep_logs, output,
+                  progress=progress, onupdate=refresh)
+    os.replace(final, trace.resultpath)
+    return refresh(trace.resultpath)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -44,7 +74,12 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--discard-log',
                         help="don't keep nmap's scan logs after tracing",
                         action='store_true')
-    args = p.parse_args()
+    parser.add_argument('-f', '--hostsfile', default=trace.targetfile,
+                        help='file from which to read the ip groups to scan')
+    parser.add_argument('-p', '--progress', type=float, default=None,
+                        help='refresh partial outputs every this many '
+                        'seconds while scanning')
+    args = parser.parse_args()
     do_scan = not args.no_scan
     keep_logs = not args.discard_log
-    run(do_scan, keep_logs)
+    run(args.hostsfile, do_scan, keep_logs, progress=args.progress)
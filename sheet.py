@@ -16,7 +16,6 @@ TODO
 from os import path
 import sys
 import trace
-from xmltodict import parse as xmlparse, unparse as xmldump
 import csv
 
 tracepath = trace.resultpath
@@ -34,10 +33,11 @@ tablecsv = path.join(trace.root_dir, 'trace_table.csv')
 
 
 def run(xml=None, output=tablecsv):
-    """constructs a semi-colon delimited csv file from trace data"""
+    """constructs a semi-colon delimited csv file from trace data,
+    xml or its already parsed structure"""
     if xml is None:
         xml = open(tracepath, 'rb').read()
-    x = xmlparse(xml, force_list=trace.xmlforced)
+    x = trace.loadxml(xml)
     if isinstance(output, str):
         output = open(output, 'w')
     # use to separate network categories/add headings
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""
+Maps the layer 2 forwarding trees of a switching fabric from the
+`show spanning-tree` output of its switches, one dump per switch
+instead of a `trace mac` per host.
+
+Vlans are streamed through ciscotraceparser's spanning tree fast
+path into an index of each vlan's bridges, from which a forwarding
+tree is built per vlan: its root bridge, and each other bridge
+linked through its root port to the bridge designated on that link.
+`show spanning-tree` doesn't name that bridge, so root ports are
+looked up in a cdpmap.CdpIndex when one is given, otherwise the
+upstream bridge is inferred from the root path costs, and its
+link marked as inferred, or left out when several bridges are
+equally likely, which `show spanning-tree` alone can't tell apart.
+
+CLI USAGE:
+
+    ./stpmap.py sw1.log sw2.log ... [-c cdp1.log ...] -o outdir
+
+    logs without prompts are taken to be from the device their
+    file is named after
+
+PYTHON USAGE:
+    >>> index = StpIndex()
+    >>> index.update(stp_vlans(open('stp.log')))
+    >>> index.root(100)
+    'sw0'
+    >>> T = index.tree(100, neighbors=cdpindex)
+    >>> G = index.graph()
+"""
+
+__author__ = 'Michael Belousov'
+
+import argparse
+import os
+import re
+import networkx as nx
+from ciscotraceparser import stp_vlans, cdp_neighbors
+from cdpmap import CdpIndex, devicename
+import visio
+
+re_port = re.compile(r'([A-Za-z-]+)\s*(.*)')
+
+
+def portkey(interface):
+    """
+    key matching a long and a short interface name, e.g. both
+    GigabitEthernet1/0/1 and Gi1/0/1 to gi1/0/1
+    """
+    m = re_port.fullmatch(interface)
+    if m is None:
+        return interface.lower()
+    return m.group(1)[:2].lower() + m.group(2)
+
+
+class StpIndex:
+    """
+    index of spanning tree vlans seen by many devices,
+    vlan -> device -> StpVlan
+    """
+    def __init__(self):
+        self.vlans = {}
+        """vlan id to its devices to their StpVlan"""
+        self.bridges = {}
+        """bridge mac to the device it belongs to"""
+
+    def add(self, device, vlan):
+        """add an StpVlan dumped by device"""
+        device = devicename(device)
+        self.vlans.setdefault(vlan.vlan, {})[device] = vlan
+        self.bridges[vlan.bridge_mac] = device
+
+    def update(self, pairs):
+        """add (device, StpVlan) pairs, e.g. from stp_vlans"""
+        for device, vlan in pairs:
+            self.add(device, vlan)
+
+    def __getitem__(self, vlan):
+        """a vlan's devices to their StpVlan"""
+        return self.vlans[vlan]
+
+    def __contains__(self, vlan):
+        return vlan in self.vlans
+
+    def __iter__(self):
+        return iter(sorted(self.vlans))
+
+    def __len__(self):
+        return len(self.vlans)
+
+    def root(self, vlan):
+        """
+        the vlan's root bridge, its device if it was dumped,
+        otherwise its mac as a string
+        """
+        bridges = self.vlans[vlan]
+        root_mac = next(iter(bridges.values())).root_mac
+        return self.bridges.get(root_mac, str(root_mac))
+
+    def candidates(self, vlan, device, used=()):
+        """
+        bridges one root port cost closer to the root than device
+        in vlan, mapped to their forwarding designated ports not
+        yet taken, in used, by another inferred link, any of which
+        could be on the other end of device's root port
+        """
+        bridge = self.vlans[vlan][device]
+        rootport, = (p for p in bridge.ports
+                     if p.interface == bridge.root_port)
+        cost = bridge.root_cost - rootport.cost
+        candidates = {}
+        for other, theirs in sorted(self.vlans[vlan].items()):
+            if other == device or theirs.root_cost != cost:
+                continue
+            ports = [p.interface for p in theirs.ports
+                     if p.role == 'Desg' and p.status == 'FWD'
+                     and (other, p.interface) not in used]
+            if ports:
+                candidates[other] = ports
+        return candidates
+
+    def upstream(self, vlan, device, neighbors=None, used=None):
+        """
+        (device, port, inferred) of the bridge on the other end of
+        device's root port in vlan, or None, used tracks the
+        (device, port) pairs inferred links already took. Without
+        cdp, a bridge is only inferred when it's the one candidate,
+        and its port only when it has one candidate port, else None
+        """
+        bridge = self.vlans[vlan][device]
+        if bridge.root_port is None:
+            return None
+        if neighbors is not None and device in neighbors:
+            key = portkey(bridge.root_port)
+            for interface, (remote, port) in \
+                    neighbors.adjacency[devicename(device)].items():
+                if portkey(interface) == key:
+                    return remote, port, False
+        rootport, = (p for p in bridge.ports
+                     if p.interface == bridge.root_port)
+        if bridge.root_cost == rootport.cost and \
+                self.root(vlan) not in self.vlans[vlan]:
+            # the root wasn't dumped, but it's the only candidate
+            return self.root(vlan), None, True
+        candidates = self.candidates(vlan, device, () if used is None
+                                     else used)
+        if len(candidates) != 1:
+            # none, or too many to tell which one it is
+            return None
+        (other, ports), = candidates.items()
+        if len(ports) != 1:
+            return other, None, True
+        if used is not None:
+            used.add((other, ports[0]))
+        return other, ports[0], True
+
+    def tree(self, vlan, neighbors=None):
+        """
+        the forwarding tree of vlan as a networkx.Graph of devices,
+        nodes have mac and root attributes, edges have ports,
+        mapping each end's device to its interface, and inferred
+        attributes, neighbors is an optional CdpIndex to resolve
+        root ports with. Bridges whose upstream bridge can't be
+        told apart from others without it are left unlinked, with
+        a candidates attribute listing the bridges it could be
+        """
+        bridges = self.vlans[vlan]
+        root = self.root(vlan)
+        T = nx.Graph()
+        T.add_node(root, mac=str(next(iter(bridges.values())).root_mac),
+                   root=True)
+        for device, bridge in bridges.items():
+            T.add_node(device, mac=str(bridge.bridge_mac),
+                       root=bridge.isroot)
+        used = set()
+        # closest bridges first, so inferred links take the
+        # designated ports in order of distance from the root
+        for device, bridge in sorted(bridges.items(),
+                                     key=lambda d: (d[1].root_cost, d[0])):
+            link = self.upstream(vlan, device, neighbors, used)
+            if link is None:
+                if bridge.root_port is not None:
+                    T.nodes[device]['candidates'] = sorted(
+                            self.candidates(vlan, device, used))
+                continue
+            other, port, inferred = link
+            T.add_edge(device, other, inferred=inferred,
+                       ports={device: bridge.root_port, other: port})
+        return T
+
+    def graph(self, neighbors=None):
+        """
+        the forwarding trees of every vlan merged into one
+        networkx.Graph, edges have a vlans attribute listing the
+        vlans forwarding over them
+        """
+        G = nx.Graph()
+        for vlan in self:
+            T = self.tree(vlan, neighbors)
+            G.add_nodes_from(T.nodes(data=True))
+            for a, b, data in T.edges(data=True):
+                if G.has_edge(a, b):
+                    G[a][b]['vlans'].append(vlan)
+                else:
+                    G.add_edge(a, b, vlans=[vlan], **data)
+        return G
+
+    def labels(self, vlan):
+        """node labels for visio, the device name and bridge mac"""
+        bridges = self.vlans[vlan]
+        root_mac = next(iter(bridges.values())).root_mac
+        labels = {self.root(vlan): f'{self.root(vlan)}\n{root_mac}'}
+        for device, bridge in bridges.items():
+            labels[device] = f'{device}\n{bridge.bridge_mac}'
+        return labels
+
+
+def render(index, outdir=os.curdir, title='stp', neighbors=None,
+           vlans=None, metadata={}):
+    """
+    graph the forwarding tree of each vlan with visio, rooted at
+    its root bridge, vlans with the same tree are graphed once,
+    returns the svg file names to the vlans they're the tree of
+    """
+    files = {}
+    drawn = {}
+    for vlan in (index if vlans is None else vlans):
+        T = index.tree(vlan, neighbors)
+        root = index.root(vlan)
+        shape = (root, frozenset(frozenset(e) for e in T.edges))
+        if shape in drawn:
+            files[drawn[shape]].append(vlan)
+            continue
+        labels = index.labels(vlan)
+        # disconnected bridges can't be laid out under the root
+        T = T.subgraph(nx.node_connected_component(T, root))
+        filename = visio.visfromgraph(T, f'{title}_vlan{vlan}',
+                                      {n: labels[n] for n in T}, root,
+                                      outpath=outdir, metadata=metadata)
+        drawn[shape] = filename
+        files[filename] = [vlan]
+    return files
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description='map the forwarding trees of a switching fabric '
+        'from show spanning-tree output')
+    p.add_argument('logs', nargs='+',
+        help='logs of show spanning-tree commands')
+    p.add_argument('-c', '--cdp', nargs='+', default=[],
+        help='logs of show cdp neighbors detail commands to resolve '
+        'root ports with')
+    p.add_argument('-v', '--vlans', type=int, nargs='+', default=None,
+        help='vlans to graph, all by default')
+    p.add_argument('-o', '--outdir', default=os.curdir,
+        help='directory to write the graphs to')
+    p.add_argument('-t', '--title', default='stp',
+        help='title of the graphs')
+    p.add_argument('-n', '--no-graph', action='store_true',
+        help='only print the forwarding trees')
+    args = p.parse_args()
+
+    index = StpIndex()
+    for log in args.logs:
+        device = os.path.splitext(os.path.basename(log))[0]
+        with open(log) as f:
+            index.update(stp_vlans(f, device))
+    neighbors = None
+    if args.cdp:
+        neighbors = CdpIndex()
+        for log in args.cdp:
+            device = os.path.splitext(os.path.basename(log))[0]
+            with open(log) as f:
+                neighbors.update(cdp_neighbors(f, device))
+
+    for vlan in (index if args.vlans is None else args.vlans):
+        T = index.tree(vlan, neighbors)
+        print(f'VLAN{vlan:04} root {index.root(vlan)}')
+        for a, b, data in sorted(T.edges(data=True)):
+            ports = data['ports']
+            inferred = ' (inferred)' if data['inferred'] else ''
+            print(f'  {a} {ports[a] or "?"} -> {b} {ports[b] or "?"}'
+                  f'{inferred}')
+        for device, candidates in sorted(T.nodes(data='candidates')):
+            if candidates is not None:
+                print(f'  {device} -> ? (one of '
+                      f'{", ".join(candidates) or "none"})')
+    if not args.no_graph:
+        for filename, vlans in render(index, args.outdir, args.title,
+                                      neighbors, args.vlans).items():
+            print(f'{filename}: vlans {", ".join(map(str, vlans))}')
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+"""
+Generates synthetic, but grammar valid, cisco cli transcripts of
+configurable sizes, for benchmarking ciscotraceparser without the
+(redacted) real logs:
+
+    tracemac: `show ip arp vrf` tables, each followed by a
+        `trace mac` per entry, including the error outputs
+        p_tracemac_err and p_tracemac_err_src match
+    cdp: `show cdp neighbors detail` of every switch of a fabric
+    stp: `show spanning-tree` of every switch of a fabric
+
+CLI USAGE:
+
+    ./synthlog.py tracemac -n 5000 -r 2 -v 3 > big.ciscotrace
+    ./synthlog.py cdp -n 200 > fabric.log
+    ./synthlog.py stp -n 20 -v 50 > stp.log
+
+PYTHON USAGE:
+    >>> with open('big.ciscotrace', 'w') as f:
+    ...     write_tracemac_log(f, hosts=5000)
+"""
+
+__author__ = 'Michael Belousov'
+
+import argparse
+import random
+import sys
+
+
+def mac(i):
+    """the i'th synthetic mac address"""
+    return f'0011.{(i >> 16) & 0xffff:04x}.{i & 0xffff:04x}'
+
+
+def ip(i, net=10):
+    """the i'th synthetic address of the /8 net"""
+    return f'{net}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+
+
+def write_arp_output(f, hosts, vlan, first=1):
+    """
+    write the output of a `show ip arp vrf`, a root entry followed
+    by hosts entries, macs and ips numbered from first
+    """
+    f.write('Protocol  Address          Age (min)  Hardware Addr   '
+            'Type   Interface\n'
+            f'Internet  {ip(first - 1)}                -   '
+            f'{mac(first - 1)}  ARPA   Port-channel1.{vlan}\n')
+    for i in range(first, first + hosts):
+        f.write(f'Internet  {ip(i)}   {i % 60:>10}   {mac(i)}  '
+                f'ARPA   Vlan{vlan}\n')
+
+
+def write_arp_table(f, router, vrf, hosts, vlan, first=1):
+    """write a `show ip arp vrf` command and its output"""
+    f.write(f'{router}#show ip arp vrf {vrf}\n')
+    write_arp_output(f, hosts, vlan, first)
+
+
+def write_trace_output(f, src, i, result='completed', odd=0.0, rand=None):
+    """
+    write the output of a `trace mac` from src to the i'th mac,
+    result is 'completed', 'error' for p_tracemac_err output, or
+    'samenbr' for p_tracemac_err_src output, odd the fraction of
+    hops written in shapes only the pyparsing grammars accept
+    """
+    if result == 'error':
+        f.write('Error: Source Mac address not found.\n'
+                'Layer2 trace aborted.\n')
+        return
+    if result == 'samenbr':
+        f.write('Source and Destination on same port and no nbr!\n')
+        return
+    hops = 1 + i % 4
+    f.write(f'Source {src} found on sw1\n')
+    for h in range(1, hops + 1):
+        inport = 'Po1' if h == 1 else f'Gi1/0/{h}'
+        if odd and rand.random() < odd:
+            # spaced interface numbers, e.g. from a jumbled session
+            inport = f'Gi 1/0/{h}'
+        f.write(f'{h} sw{h} (10.255.0.{h}) : {inport} => '
+                f'Gi1/0/{h + 1}\n')
+    f.write(f'Destination {mac(i)} found on sw{hops}\n'
+            'Layer 2 trace completed\n')
+
+
+def write_traces(f, router, hosts, vlan, first=1, errors=0.1,
+                 samenbr=0.02, odd=0.0, rand=None):
+    """
+    write a `trace mac` from the root entry to each of the hosts
+    numbered from first, errors and samenbr are the fractions
+    failing with p_tracemac_err and p_tracemac_err_src output
+    """
+    if rand is None:
+        rand = random.Random(0)
+    src = mac(first - 1)
+    for i in range(first, first + hosts):
+        f.write(f'{router}#trace mac {src} {mac(i)} vlan {vlan}\n')
+        r = rand.random()
+        result = 'error' if r < errors else \
+                 'samenbr' if r < errors + samenbr else 'completed'
+        write_trace_output(f, src, i, result, odd, rand)
+
+
+def write_tracemac_log(f, hosts, routers=1, vrfs=1, errors=0.1,
+                       samenbr=0.02, odd=0.0, seed=0):
+    """
+    write a log of arp tables and their traces, hosts split evenly
+    over the vrfs of each router, returns the number of traces
+    """
+    rand = random.Random(seed)
+    per = max(1, hosts // (routers * vrfs))
+    first = 1
+    traces = 0
+    for r in range(routers):
+        for v in range(vrfs):
+            vlan = 100 + v
+            write_arp_table(f, f'rtr{r + 1}', f'VRF{v + 1}', per, vlan, first)
+            write_traces(f, f'rtr{r + 1}', per, vlan, first, errors,
+                         samenbr, odd, rand)
+            # leave room for the next table's root entry
+            first += per + 1
+            traces += per
+    return traces
+
+
+def fabric(switches, seed=0):
+    """
+    links of a synthetic switching fabric, a random tree of the
+    switches, as (switch, port, switch, port) tuples
+    """
+    rand = random.Random(seed)
+    links = []
+    ports = [1] * switches
+    for child in range(1, switches):
+        parent = rand.randrange(child)
+        ports[parent] += 1
+        links.append((parent, ports[parent], child, 1))
+    return links
+
+
+def write_cdp_entry(f, device, address, interface, port):
+    """write one `show cdp neighbors detail` entry"""
+    f.write('-------------------------\n'
+            f'Device ID: {device}.example.com\n'
+            'Entry address(es): \n'
+            f'  IP address: {address}\n'
+            'Platform: cisco WS-C2960X-48FPD-L,  Capabilities: Switch IGMP \n'
+            f'Interface: {interface},  Port ID (outgoing port): {port}\n'
+            'Holdtime : 150 sec\n'
+            '\n'
+            'Version :\n'
+            'Cisco IOS Software, C2960X Software (C2960X-UNIVERSALK9-M), '
+            'Version 15.2(2)E7, RELEASE SOFTWARE (fc3)\n'
+            'Technical Support: http://www.cisco.com/techsupport\n'
+            'Copyright (c) 1986-2017 by Cisco Systems, Inc.\n'
+            'Compiled Wed 12-Jul-17 13:13 by prod_rel_team\n'
+            '\n'
+            'advertisement version: 2\n'
+            'Protocol Hello:  OUI=0x00000C, Protocol ID=0x0112; '
+            'payload len=27, value=00000000FFFFFFFF010221FF000000000000'
+            'ECE1A9A1B200FF0000\n'
+            "VTP Management Domain: 'corp'\n"
+            'Native VLAN: 1\n'
+            'Duplex: full\n'
+            'Management address(es): \n'
+            f'  IP address: {address}\n'
+            '\n')
+
+
+def write_cdp_log(f, switches, seed=0):
+    """
+    write `show cdp neighbors detail` of every switch of a synthetic
+    fabric, returns the number of entries
+    """
+    neighbors = [[] for _ in range(switches)]
+    for a, aport, b, bport in fabric(switches, seed):
+        neighbors[a].append((aport, b, bport))
+        neighbors[b].append((bport, a, aport))
+    entries = 0
+    for s in range(switches):
+        f.write(f'sw{s}#show cdp neighbors detail\n')
+        for port, other, otherport in neighbors[s]:
+            write_cdp_entry(f, f'sw{other}', ip(other, 172),
+                            f'GigabitEthernet1/0/{port}',
+                            f'GigabitEthernet1/0/{otherport}')
+            entries += 1
+    return entries
+
+
+def write_stp_vlan(f, vlan, root, bridge, cost, rootport, ports):
+    """
+    write one vlan of `show spanning-tree`, root and bridge are the
+    switch numbers, rootport None on the root, ports are
+    (port, role, status) tuples
+    """
+    f.write(f'VLAN{vlan:04}\n'
+            '  Spanning tree enabled protocol ieee\n'
+            f'  Root ID    Priority    {24576 + vlan}\n'
+            f'             Address     {mac(root)}\n')
+    if rootport is None:
+        f.write('             This bridge is the root\n')
+    else:
+        f.write(f'             Cost        {cost}\n'
+                f'             Port        {rootport} '
+                f'(GigabitEthernet1/0/{rootport})\n')
+    f.write('             Hello Time   2 sec  Max Age 20 sec  '
+            'Forward Delay 15 sec\n'
+            '\n'
+            f'  Bridge ID  Priority    {32768 + vlan}  '
+            f'(priority 32768 sys-id-ext {vlan})\n'
+            f'             Address     {mac(bridge)}\n'
+            '             Hello Time   2 sec  Max Age 20 sec  '
+            'Forward Delay 15 sec\n'
+            '             Aging Time  300 sec\n'
+            '\n'
+            'Interface           Role Sts Cost      Prio.Nbr Type\n'
+            '------------------- ---- --- --------- -------- '
+            '--------------------------------\n')
+    for port, role, status in ports:
+        interface = f'Gi1/0/{port}'
+        f.write(f'{interface:<19} {role} {status} {4:<9} '
+                f'{f"128.{port}":<8} P2p\n')
+    f.write('\n')
+
+
+def write_stp_log(f, switches, vlans=1, seed=0):
+    """
+    write `show spanning-tree` of every switch of a synthetic
+    fabric, rooted at switch 0, with a redundant blocked link
+    from every third switch, returns the number of vlan sections
+    """
+    links = fabric(switches, seed)
+    ports = [[] for _ in range(switches)]
+    parent = {}
+    for a, aport, b, bport in links:
+        ports[a].append((aport, 'Desg', 'FWD'))
+        ports[b].append((bport, 'Root', 'FWD'))
+        parent[b] = a
+    depth = [0] * switches
+    for child in range(1, switches):
+        depth[child] = depth[parent[child]] + 1
+    for s in range(3, switches, 3):
+        ports[s].append((48, 'Altn', 'BLK'))
+    sections = 0
+    for s in range(switches):
+        f.write(f'sw{s}#show spanning-tree\n')
+        for v in range(vlans):
+            rootport = None if s == 0 else 1
+            write_stp_vlan(f, 100 + v, 0, s, 4 * depth[s], rootport,
+                           sorted(ports[s]))
+            sections += 1
+    return sections
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description='write synthetic cisco cli transcripts to stdout')
+    p.add_argument('kind', choices=('tracemac', 'cdp', 'stp'),
+        help='which command outputs to generate')
+    p.add_argument('-n', '--size', type=int, default=1000,
+        help='number of hosts traced, or of switches for cdp and stp')
+    p.add_argument('-r', '--routers', type=int, default=1,
+        help='number of routers the traces are split over')
+    p.add_argument('-v', '--vrfs', type=int, default=1,
+        help='number of vrfs per router, or vlans per switch for stp')
+    p.add_argument('-e', '--errors', type=float, default=0.1,
+        help='fraction of traces failing')
+    p.add_argument('-s', '--seed', type=int, default=0,
+        help='random seed')
+    args = p.parse_args()
+
+    if args.kind == 'tracemac':
+        write_tracemac_log(sys.stdout, args.size, args.routers, args.vrfs,
+                           args.errors, seed=args.seed)
+    elif args.kind == 'cdp':
+        write_cdp_log(sys.stdout, args.size, args.seed)
+    else:
+        write_stp_log(sys.stdout, args.size, args.vrfs, args.seed)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""
+Tests of batch_cisco_mactrace.py's session pool, pipelining,
+retries and trace cache, run against fakeios.py's FakeRouter,
+with graphing stubbed out.
+
+USAGE
+    python -m pytest test_batch_cisco_mactrace.py
+    python -m unittest test_batch_cisco_mactrace
+"""
+
+__author__ = 'Michael Belousov'
+
+import csv
+import os
+import tempfile
+import unittest
+from unittest import mock
+import batch_cisco_mactrace as batch
+import fakeios
+import tracecache
+
+hosts = 40
+"""hosts in each fake vrf"""
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        for name, value in (('retrybackoff', 0.0), ('batchsize', 1),
+                            ('router_sessions', {}),
+                            ('mactracecache', None)):
+            patcher = mock.patch.object(batch, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(batch.visio, 'run', return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def scan(self, router, vrfs=('VRF1',), jobs=1, workers=1):
+        """scan vrfs of a FakeRouter to a new outdir, returns the
+        VrfResults and the log of each vrf"""
+        self.outdir = outdir = tempfile.mkdtemp(dir=self.tmp)
+        results = batch.run_inventory(
+                [(router.hostname, vrf) for vrf in vrfs], None, None,
+                outdir, workers, jobs, lambda _: router.connect())
+        logs = {}
+        for vrf in vrfs:
+            path = os.path.join(outdir, f'{router.hostname}_{vrf}.ciscotrace')
+            with open(path) as f:
+                logs[vrf] = f.read()
+        return results, logs
+
+    def traces(self, router):
+        """the trace mac commands router ran"""
+        return [cmd for cmd in router.commands
+                if cmd.startswith('trace mac')]
+
+
+class TestSessionPool(BatchTestCase):
+    def test_log_in_arp_order_over_sessions(self):
+        _, expected = self.scan(fakeios.FakeRouter(vrfs={'VRF1': hosts}))
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts}, latency=0.002)
+        results, logs = self.scan(router, jobs=4)
+        self.assertGreater(router.maxsessions, 1)
+        self.assertEqual(logs, expected)
+        self.assertTrue(all(r.ok and not r.givenup for r in results))
+
+    def test_sessions_within_poolsize(self):
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts, 'VRF2': hosts},
+                                    latency=0.002)
+        self.scan(router, ('VRF1', 'VRF2'), jobs=4, workers=2)
+        self.assertLessEqual(router.maxsessions, 4)
+        self.assertEqual(router.sessions, 0)
+
+    def test_router_sessions_cap(self):
+        batch.router_sessions['rtr1'] = 2
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts, 'VRF2': hosts},
+                                    latency=0.002)
+        self.scan(router, ('VRF1', 'VRF2'), jobs=8, workers=2)
+        self.assertLessEqual(router.maxsessions, 2)
+
+
+class TestPipelining(BatchTestCase):
+    def test_pipelined_log_is_identical(self):
+        _, expected = self.scan(fakeios.FakeRouter(vrfs={'VRF1': hosts}))
+        for size in (2, 7, hosts * 2):
+            with mock.patch.object(batch, 'batchsize', size):
+                for jobs in (1, 3):
+                    _, logs = self.scan(
+                            fakeios.FakeRouter(vrfs={'VRF1': hosts}),
+                            jobs=jobs)
+                    self.assertEqual(logs, expected, (size, jobs))
+
+
+class TestRetries(BatchTestCase):
+    def test_flaky_outputs_are_retried(self):
+        _, expected = self.scan(fakeios.FakeRouter(vrfs={'VRF1': hosts}))
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts}, flaky=0.3)
+        # enough retries that no trace is likely to stay cut off
+        with mock.patch.object(batch, 'maxtracetries', 10):
+            (result,), logs = self.scan(router, jobs=2)
+        self.assertGreater(len(self.traces(router)), hosts)
+        self.assertEqual(logs, expected)
+        self.assertEqual(result.givenup, [])
+
+    def test_given_up_traces_are_summarized(self):
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts}, flaky=0.3)
+        with mock.patch.object(batch, 'maxtracetries', 0):
+            (result,), logs = self.scan(router)
+        self.assertTrue(result.ok)
+        self.assertTrue(result.givenup)
+        for cmd in result.givenup:
+            self.assertNotIn(cmd, logs['VRF1'])
+        with open(os.path.join(self.outdir, batch.summaryname)) as f:
+            row, = csv.DictReader(f)
+        self.assertEqual(row['status'], 'partial')
+        self.assertEqual(row['givenup'], '; '.join(result.givenup))
+
+    def test_failed_batches_are_retried(self):
+        _, expected = self.scan(fakeios.FakeRouter(vrfs={'VRF1': hosts}))
+        send_pipelined = batch.send_pipelined
+        calls = []
+
+        def failing(ssh, cmds, timeout=None):
+            # the second batch times out and leaves its session closed
+            calls.append(cmds)
+            if len(calls) == 2:
+                ssh.disconnect()
+                raise Exception('pipelined commands timed out')
+            return send_pipelined(ssh, cmds, timeout)
+
+        with mock.patch.object(batch, 'batchsize', 5), \
+                mock.patch.object(batch, 'send_pipelined', failing):
+            router = fakeios.FakeRouter(vrfs={'VRF1': hosts})
+            (result,), logs = self.scan(router, jobs=2)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.givenup, [])
+        self.assertEqual(logs, expected)
+
+
+class TestCache(BatchTestCase):
+    def test_cached_pairs_are_not_resent(self):
+        cache = tracecache.MacTraceCache(os.path.join(self.tmp, 'cache.db'))
+        self.addCleanup(cache.close)
+        batch.mactracecache = cache
+        # errors aren't cached, so without any every pair is
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts}, errors=0)
+        _, expected = self.scan(router, jobs=2)
+        self.assertEqual(len(self.traces(router)), hosts)
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts}, errors=0)
+        _, logs = self.scan(router, jobs=2)
+        self.assertEqual(self.traces(router), [])
+        self.assertEqual(logs, expected)
+
+    def test_errors_are_traced_again(self):
+        cache = tracecache.MacTraceCache(os.path.join(self.tmp, 'cache.db'))
+        self.addCleanup(cache.close)
+        batch.mactracecache = cache
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts})
+        self.scan(router)
+        errors = [cmd for cmd in self.traces(router)
+                  if int(cmd.split()[3].replace('.', ''), 16)
+                  % router.errors == 0]
+        router = fakeios.FakeRouter(vrfs={'VRF1': hosts})
+        self.scan(router)
+        self.assertTrue(errors)
+        self.assertEqual(self.traces(router), errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
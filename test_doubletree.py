@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""
+Tests of doubletree.py, real probes over the loopback interface,
+and the forward, backward and stop set logic over a simulated
+topology of two routers in front of a subnet of hosts.
+
+USAGE
+    python -m pytest test_doubletree.py
+    python -m unittest test_doubletree
+"""
+
+__author__ = 'Michael Belousov'
+
+import asyncio
+import sys
+import unittest
+from unittest import mock
+import doubletree
+
+routers = ['10.1.0.2', '10.2.0.2']
+"""the simulated routers, in hop order"""
+
+unroutable = '10.9.0.1'
+"""a destination the last router has no route to"""
+
+
+async def simulated_probe(dest, ttl, wait=doubletree.timeout):
+    """
+    probe a simulated topology, hosts of 10.3.0.0/24 are a hop
+    past the routers, and the last router answers probes to
+    unroutable with a net unreachable
+    """
+    await asyncio.sleep(0)
+    if ttl <= len(routers):
+        addr = routers[ttl - 1]
+        if dest == unroutable and ttl == len(routers):
+            return (addr, *doubletree.classify(
+                    dest, addr, doubletree.ICMP_DEST_UNREACH, 0))
+        return addr, False, False
+    if dest == unroutable:
+        addr = routers[-1]
+        return (addr, *doubletree.classify(
+                dest, addr, doubletree.ICMP_DEST_UNREACH, 0))
+    return (dest, *doubletree.classify(
+            dest, dest, doubletree.ICMP_DEST_UNREACH,
+            doubletree.ICMP_PORT_UNREACH))
+
+
+class TestClassify(unittest.TestCase):
+    def test_port_unreachable_from_dest_is_reached(self):
+        self.assertEqual(doubletree.classify(
+            '10.3.0.10', '10.3.0.10', doubletree.ICMP_DEST_UNREACH,
+            doubletree.ICMP_PORT_UNREACH), (True, False))
+
+    def test_router_unreachable_is_not_reached(self):
+        # host, net and admin prohibited unreachables from a router
+        for code in (0, 1, 13):
+            self.assertEqual(doubletree.classify(
+                '10.3.0.10', '10.2.0.2', doubletree.ICMP_DEST_UNREACH,
+                code), (False, True))
+
+    def test_time_exceeded_is_a_hop(self):
+        self.assertEqual(doubletree.classify(
+            '10.3.0.10', '10.2.0.2', 11, 0), (False, False))
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'),
+                     'probes read the linux socket error queue')
+class TestLoopback(unittest.TestCase):
+    def test_probe_reaches_loopback(self):
+        addr, reached, unreachable = asyncio.run(
+                doubletree.probe('127.0.0.1', 1, 2.0))
+        self.assertEqual(addr, '127.0.0.1')
+        self.assertTrue(reached)
+        self.assertFalse(unreachable)
+
+    def test_trace_loopback(self):
+        engine = doubletree.Doubletree(timeout=2.0, resolve=False)
+        (dest, hostname, hops), = engine.run(['127.0.0.1'])
+        self.assertEqual(dest, '127.0.0.1')
+        self.assertEqual(hops, [(1, '127.0.0.1', None)])
+
+
+class TestStopSet(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(doubletree, 'probe', simulated_probe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_engine(self, dests, starthop=3):
+        engine = doubletree.Doubletree(starthop, concurrency=1,
+                                       resolve=False)
+        return engine, {dest: [(ttl, addr) for ttl, addr, _ in hops]
+                        for dest, _, hops in engine.run(dests)}
+
+    def test_every_host_gets_its_full_path(self):
+        dests = [f'10.3.0.{i}' for i in range(10, 15)]
+        _, paths = self.run_engine(dests)
+        for dest in dests:
+            self.assertEqual(paths[dest], [(1, routers[0]), (2, routers[1]),
+                                           (3, dest)])
+
+    def test_shared_hops_are_probed_once(self):
+        dests = [f'10.3.0.{i}' for i in range(10, 15)]
+        engine, _ = self.run_engine(dests)
+        # the first trace probes all 3 hops, the others stop backward
+        # probing at the second router, already in the stop set
+        self.assertEqual(engine.probes, 3 + 2 * (len(dests) - 1))
+
+    def test_router_unreachable_ends_the_path(self):
+        engine, paths = self.run_engine([unroutable], starthop=1)
+        self.assertEqual(paths[unroutable], [(1, routers[0]),
+                                             (2, routers[1])])
+        self.assertEqual(engine.probes, 2)
+
+    def test_destination_closer_than_starthop(self):
+        _, paths = self.run_engine(['10.3.0.10'], starthop=5)
+        self.assertEqual(paths['10.3.0.10'], [(1, routers[0]),
+                                              (2, routers[1]),
+                                              (3, '10.3.0.10')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Tests of run.py's scan, table and graph pipeline, run end to end
+against fakenmap.py in a temporary directory, with only the svg
+drawing stubbed out.
+
+USAGE
+    python -m pytest test_run.py
+    python -m unittest test_run
+"""
+
+__author__ = 'Michael Belousov'
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import fakenmap
+import run
+import sheet
+import trace
+import visio
+
+targets = 'Net1: 10.0.0.1-10.0.0.4\n'
+"""the network scanned"""
+
+
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        with open('targets.ips', 'w') as f:
+            f.write(targets)
+        # (csv, graphed addresses) of every svg drawn
+        self.refreshes = []
+        for obj, name, value in (
+                (trace, 'nmapcmd', fakenmap.command(delay=0.2)),
+                (trace, 'iplist', trace.IPFile()),
+                (trace, 'tailpoll', 0.01),
+                (visio, 'svg_from_nxgraph', self.draw)):
+            patcher = mock.patch.object(obj, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def draw(self, G, pos, icons, types, labels, output, *args):
+        """write the graph's nodes as the svg, and keep it along
+        with the csv it was drawn with"""
+        with open(output, 'w') as f:
+            f.write('\n'.join(sorted(G)))
+        with open(sheet.tablecsv) as f:
+            table = f.read()
+        self.refreshes.append((table, set(G) & set(trace.iplist)))
+
+    def test_targets_are_loaded(self):
+        iplist = trace.IPFile()
+        iplist.fromstr(targets)
+        for target in ('targets.ips', iplist):
+            files = run.run(target)
+            self.assertEqual(files, [os.path.join(trace.root_dir,
+                                                  'Net1.svg')])
+            self.assertEqual(sorted(trace.iplist), sorted(iplist))
+        with open('Net1.svg') as f:
+            self.assertEqual(set(f.read().split()) & set(iplist),
+                             set(iplist))
+
+    def test_partial_outputs_come_first(self):
+        run.run('targets.ips', progress=0)
+        (first, partial), *_, (last, final) = self.refreshes
+        self.assertLess(len(partial), len(final))
+        self.assertEqual(final, set(trace.iplist))
+        for addr in trace.iplist:
+            self.assertIn(addr, last)
+            self.assertEqual(addr in first, addr in partial)
+        # the final trace.xml replaced the partial one
+        self.assertFalse(os.path.exists(trace.resultpath + '.part'))
+        with open(trace.resultpath) as f:
+            net, = trace.loadxml(f.read())['networks']['network']
+        self.assertEqual(len(net['hosts']['host']), len(trace.iplist))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+Tests of trace.py's scans, run against fakenmap.py in a
+temporary directory, in place of nmap.
+
+USAGE
+    python -m pytest test_trace.py
+    python -m unittest test_trace
+"""
+
+__author__ = 'Michael Belousov'
+
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+import fakenmap
+import trace
+
+targets = 'Net1: 10.0.0.0/29\nNet2: 10.0.1.8/30\n'
+"""the networks scanned"""
+
+
+class TraceTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        for name, value in (('nmapcmd', fakenmap.command()),
+                            ('discoverycmd',
+                             fakenmap.command(discovery=True)),
+                            ('iplist', trace.IPFile()),
+                            ('tailpoll', 0.01)):
+            patcher = mock.patch.object(trace, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        trace.iplist.fromstr(targets)
+
+    def scan(self, down=(), **kwargs):
+        """run a scan with the down hosts not responding, returns the
+        resulting trace.xml structure's hosts by address"""
+        output = io.StringIO()
+        with mock.patch.object(trace, 'nmapcmd', fakenmap.command(down)), \
+                mock.patch.object(trace, 'discoverycmd',
+                                  fakenmap.command(down, discovery=True)):
+            trace.run(output=output, **kwargs)
+        self.result = trace.loadxml(output.getvalue())
+        return {host['address']: host
+                for net in self.result['networks']['network']
+                for host in net['hosts']['host']}
+
+
+class TestCache(TraceTestCase):
+    def test_untraced_host_is_rescanned(self):
+        hosts = self.scan(['10.0.0.3'], cache=True)
+        self.assertIsNone(hosts['10.0.0.3']['trace'])
+        with mock.patch.object(trace, 'nmap', wraps=trace.nmap) as nmap:
+            hosts = self.scan(cache=True)
+        (scanned, *_), _ = nmap.call_args
+        self.assertEqual(scanned, [(trace.ip_to_int('10.0.0.3'),) * 2])
+        self.assertEqual(len(hosts), len(trace.iplist))
+        self.assertEqual(hosts['10.0.0.3']['trace']['hop'][-1]['address'],
+                         '10.0.0.3')
+
+    def test_traced_hosts_are_cached(self):
+        self.scan(cache=True)
+        with mock.patch.object(trace, 'nmap') as nmap:
+            hosts = self.scan(cache=True)
+        nmap.assert_not_called()
+        self.assertEqual(len(hosts), len(trace.iplist))
+
+
+
+class TestDiscovery(TraceTestCase):
+    down = ['10.0.0.1', '10.0.0.2', '10.0.0.6', '10.0.1.11']
+
+    def test_only_live_hosts_are_traced(self):
+        with mock.patch.object(trace, 'nmap', wraps=trace.nmap) as nmap:
+            hosts = self.scan(self.down, twophase=True)
+        (traced, *_), _ = nmap.call_args
+        ip = trace.ip_to_int
+        self.assertEqual(traced, [(ip('10.0.0.0'), ip('10.0.0.0')),
+                                  (ip('10.0.0.3'), ip('10.0.0.5')),
+                                  (ip('10.0.0.7'), ip('10.0.0.7')),
+                                  (ip('10.0.1.8'), ip('10.0.1.10'))])
+        self.assertEqual(sorted(hosts), sorted(
+                set(trace.iplist) - set(self.down)))
+        dead = {net['networkname']: int(net['deadhosts'])
+                for net in self.result['networks']['network']}
+        self.assertEqual(dead, {'Net1': 3, 'Net2': 1})
+
+    def test_failed_shards_count_as_live(self):
+        # the other shards' merged log, in which nothing responded
+        with open(trace.discoverypath, 'w') as f:
+            f.write(fakenmap.header.format('') + fakenmap.footer)
+        with mock.patch.object(trace, 'trace_shards',
+                               return_value=[1]) as shards:
+            live, dead = trace.discover(trace.iplist, size=8)
+        self.assertEqual(shards.call_count, 1)
+        # the second shard is Net2's 4 addresses
+        self.assertEqual(list(live), ['10.0.1.8', '10.0.1.9',
+                                      '10.0.1.10', '10.0.1.11'])
+        self.assertEqual(dead, {'Net1': 8, 'Net2': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,18 @@ OPTIONS
         do not perform an nmap scan, instead just generate the 
         aggregated data from previously gathered nmap data.
     -d/--discard-log
+    -c/--cache
+        only trace hosts whose traces are missing from, or expired in,
+        the per-host trace cache (trace_cache.sqlite), the output merges
+        fresh and cached traces
+    -r/--resume
+        sharded scans are checkpointed in numbered chunks (.trace_chunks),
+        this continues an interrupted scan, only scanning the unfinished
+        chunks, then merges every chunk's log
+    -l/--live-only
+        two-phase scan, a fast host discovery sweep first, then only
+        the responsive hosts are traced, the rest are counted in each
+        network's <deadhosts>
     this is out of date and will remain so for now. Use the -h command to see a more up to date
     documentation of the command line functionality
 
@@ -24,8 +36,6 @@ TODO
     ? add a more verbose output option that preserves most nmap host data?
     - clean up naming consistency
     - check for IP syntax errors while reading *.ips
-    ? add caching of traceroute data for individual hosts
-        ? using database schema? pickled table?
     - add unit test battery?
     - speedup scan processing
     COMMAND LINE:
@@ -38,16 +48,34 @@ OTHER
 
 import subprocess as subproc
 from netaddr import IPNetwork, iprange_to_cidrs, IPAddress
+from netaddr.core import AddrFormatError
 import os
 import sys
+import socket
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
 from os import path
 from xmltodict import parse as xmlparse, unparse as xmldump
 from collections import OrderedDict as odict
 from securitycenter import SecurityCenter5
 from configparser import SafeConfigParser
 import tempfile
+import shutil
+import json
+import time
+import itertools
 import argparse
-from collections import OrderedDict as odict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict as odict, namedtuple
+import xml.etree.ElementTree as ET
+import tracecache
+import doubletree
+try:
+    import numpy as np
+except ImportError:  # optional, only speeds up IPFile.classify
+    np = None
 
 #### Module-Level [Default] Attributes
 
@@ -70,6 +98,48 @@ resultpath = path.join(root_dir, 'trace.xml')
 hostspath = tempfile.mkstemp(prefix='.temp_hostpath')[1]
 """temporary file that is used to list the hosts for nmap to scan"""
 
+nmapcmd = ['nmap', '--privileged', '-sn', '-Pn', '-T5', '--traceroute', '-v']
+"""nmap command, without its input and output arguments"""
+
+discoverycmd = ['nmap', '--privileged', '-sn', '-T5', '-v']
+"""nmap host discovery (ping sweep) command for two-phase scans"""
+
+discoverypath = path.join(root_dir, 'nmap_discovery.xml')
+"""path to the nmap host discovery log of a two-phase scan"""
+
+backend = 'nmap'
+"""traceroute backend, 'nmap' or 'doubletree' (see doubletree.py)"""
+
+shardsize = None
+"""
+maximum number of addresses per nmap process, if set, the scan
+is split into shards run concurrently, otherwise one nmap runs
+"""
+
+shardbynetwork = False
+"""whether shards are also split at network boundaries"""
+
+concurrency = 4
+"""maximum number of concurrently running nmap shards"""
+
+tailpoll = 1.0
+"""seconds between reads of an nmap log that is being followed"""
+
+checkpointdir = path.join(root_dir, '.trace_chunks')
+"""
+directory where sharded scans persist their numbered chunks' target
+lists and nmap logs, so an interrupted scan can be resumed
+"""
+
+chunksize = 256
+"""number of addresses per chunk when resuming a scan that isn't sharded"""
+
+cachepath = path.join(root_dir, 'trace_cache.sqlite')
+"""path of the persistent per-host trace cache"""
+
+cachettl = tracecache.default_ttl
+"""seconds before a cached host trace is traced again"""
+
 # TODO: rename to something like listtags
 xmlforced = ('host', 'hop', 'network')  #, 'address')
 """tuple of xml tags that form lists, especially for use with xmltodict"""
@@ -92,17 +162,359 @@ def iprange_decode(ipr):
     result = [str(i) for i in result]
     return result
 
+def iprange_interval(ipr):
+    """
+    Returns the first and last integer addresses of an IPv4 subnet
+    or range, raises for IPv6 ones, the intervals are 32 bit
+    """
+    # netaddr module should have robust enough AddrFormatError for this
+    if '-' in ipr:
+        first, last = (IPAddress(i.strip()) for i in ipr.split('-'))
+        version = max(first.version, last.version)
+    else:
+        net = IPNetwork(ipr)
+        first, last, version = net.first, net.last, net.version
+    if version != 4:
+        raise Exception('Only IPv4 targets are supported, not {}'.format(ipr))
+    return int(first), int(last)
+
+def ip_to_int(addr):
+    """fast conversion of a dotted ipv4 string to an integer"""
+    return struct.unpack('!L', socket.inet_aton(addr))[0]
+
+def int_to_ip(addr):
+    """fast conversion of an integer to a dotted ipv4 string"""
+    return socket.inet_ntoa(struct.pack('!L', addr))
+
+def range_blocks(start, end):
+    """
+    the minimal list of CIDR blocks, as (address, prefixlen) integer
+    pairs, covering the integer addresses start through end
+    """
+    blocks = []
+    while start <= end:
+        # largest block aligned at start that doesn't pass end
+        size = (start & -start).bit_length() - 1 if start else 32
+        while start + (1 << size) - 1 > end:
+            size -= 1
+        blocks.append((start, 32 - size))
+        start += 1 << size
+    return blocks
+
+def range_cidrs(start, end):
+    """the minimal list of CIDR strings covering start through end"""
+    return [int_to_ip(a) if n == 32 else '{}/{}'.format(int_to_ip(a), n)
+            for a, n in range_blocks(start, end)]
+
+def compact_ranges(ranges):
+    """
+    cover sorted, disjoint (start, end) ranges with as few CIDR blocks
+    as possible, greedily bridging the gap between neighboring ranges
+    when covering them together and excluding the gap takes fewer
+    blocks. Returns (covered, excluded) lists of (start, end) ranges,
+    where the addresses of ranges are covered minus excluded.
+    """
+    nblocks = lambda start, end: len(range_blocks(start, end))
+    covered, excluded = [], []
+    for start, end in ranges:
+        if covered:
+            prevstart, prevend = covered[-1]
+            separate = nblocks(prevstart, prevend) + nblocks(start, end)
+            bridged = nblocks(prevstart, end) + nblocks(prevend + 1, start - 1)
+            if bridged <= separate:
+                covered[-1] = (prevstart, end)
+                if prevend + 1 < start:
+                    excluded.append((prevend + 1, start - 1))
+                continue
+        covered.append((start, end))
+    return covered, excluded
+
 # TODO: rename, it's just a host iterator/network mapping now
 # TODO: add support for domain names
-# TODO: add support for miscellaneous IPs
-# TODO: use IPSet from netaddr
-class IPFile(odict):
+class IPFile(Mapping):
     """
-    On instantiation, fetches asset data on init, and maps ips
-    to networks defined in the file.
+    Maps ips to networks defined in the file, stored as sorted,
+    disjoint integer intervals of addresses, so lookups are a
+    binary search and ranges are never expanded in memory.
+    Iterating yields every address (as a string) lazily.
     Can also parses an *.ips file, which is in the format:
     Networkname: iprange,CIDR,singleip,etc,e.g.,10.9.40.1-10.9.40.4,137.99.22.231/30
     """
+    typecode = 'L'
+    """array typecode of the interval bounds, XXX: ipv4 only"""
+
+    def __init__(self):
+        self.starts = array(self.typecode)
+        self.ends = array(self.typecode)
+        self.names = []
+        self.named = odict()
+        """targets that aren't addresses, e.g. domain names"""
+
+    def add(self, target, network):
+        """map a range, subnet, single ip or name to a network"""
+        try:
+            start, end = iprange_interval(target)
+        except (AddrFormatError, ValueError):
+            self.named[target] = network
+            return
+        self.insert(start, end, network)
+
+    def insert(self, start, end, network):
+        """
+        map the integer addresses start through end to network,
+        overriding any previous mapping of them, a network of
+        None unmaps them
+        """
+        starts, ends, names = self.starts, self.ends, self.names
+        # intervals [i, j) overlap the new one
+        i = bisect_left(ends, start)
+        j = bisect_right(starts, end)
+        pieces = []
+        if i < j and starts[i] < start:
+            pieces.append((starts[i], start - 1, names[i]))
+        pieces.append((start, end, network))
+        if i < j and ends[j - 1] > end:
+            pieces.append((end + 1, ends[j - 1], names[j - 1]))
+        # include the neighbors so adjacent intervals of
+        # the same network coalesce into one
+        lo, hi = max(i - 1, 0), min(j + 1, len(starts))
+        pieces = ([(starts[k], ends[k], names[k]) for k in range(lo, i)]
+                  + pieces
+                  + [(starts[k], ends[k], names[k]) for k in range(j, hi)])
+        merged = []
+        for piece in pieces:
+            if piece[2] is None:
+                continue
+            if (merged and merged[-1][1] + 1 == piece[0]
+                    and merged[-1][2] == piece[2]):
+                merged[-1] = (merged[-1][0], piece[1], piece[2])
+            else:
+                merged.append(piece)
+        starts[lo:hi] = array(self.typecode, (m[0] for m in merged))
+        ends[lo:hi] = array(self.typecode, (m[1] for m in merged))
+        names[lo:hi] = [m[2] for m in merged]
+
+    def discard(self, addr):
+        """unmap a single address or name if it is mapped"""
+        try:
+            addr = ip_to_int(addr)
+        except OSError:
+            self.named.pop(addr, None)
+            return
+        self.insert(addr, addr, None)
+
+    def without(self, addrs):
+        """
+        a copy without the given addresses and names, built in one
+        sweep of the intervals, instead of splicing every address
+        out of the arrays with discard
+        """
+        holes, names = set(), set()
+        for addr in addrs:
+            try:
+                holes.add(ip_to_int(addr))
+            except OSError:
+                names.add(addr)
+        holes = sorted(holes)
+        other = type(self)()
+        h = 0
+        for start, end, name in self.intervals():
+            while h < len(holes) and holes[h] < start:
+                h += 1
+            # split the interval around the holes in it
+            while h < len(holes) and holes[h] <= end:
+                if holes[h] > start:
+                    other.starts.append(start)
+                    other.ends.append(holes[h] - 1)
+                    other.names.append(name)
+                start = holes[h] + 1
+                h += 1
+            if start <= end:
+                other.starts.append(start)
+                other.ends.append(end)
+                other.names.append(name)
+        other.named = odict((t, n) for t, n in self.named.items()
+                            if t not in names)
+        return other
+
+    def only(self, ranges):
+        """
+        a copy of only the mapped addresses within the given (start,
+        end) integer ranges, without any named targets, built in one
+        sweep of the intervals, instead of inserting every address
+        """
+        keep = []
+        for start, end in sorted(ranges):
+            if keep and keep[-1][1] + 1 >= start:
+                keep[-1] = (keep[-1][0], max(keep[-1][1], end))
+            else:
+                keep.append((start, end))
+        other = type(self)()
+        k = 0
+        for start, end, name in self.intervals():
+            while k < len(keep) and keep[k][1] < start:
+                k += 1
+            # the kept ranges overlapping the interval, the last
+            # one can overlap the next interval too
+            j = k
+            while j < len(keep) and keep[j][0] <= end:
+                other.starts.append(max(start, keep[j][0]))
+                other.ends.append(min(end, keep[j][1]))
+                other.names.append(name)
+                j += 1
+        return other
+
+    def copy(self):
+        other = type(self)()
+        other.starts = array(self.typecode, self.starts)
+        other.ends = array(self.typecode, self.ends)
+        other.names = list(self.names)
+        other.named = odict(self.named)
+        return other
+
+    def find(self, addr):
+        """
+        index of the interval holding an integer address, or -1
+        """
+        i = bisect_right(self.starts, addr) - 1
+        if i >= 0 and addr <= self.ends[i]:
+            return i
+        return -1
+
+    def __getitem__(self, addr):
+        if isinstance(addr, int):
+            i = self.find(addr)
+        else:
+            try:
+                i = self.find(ip_to_int(addr))
+            except OSError:
+                return self.named[addr]
+        if i < 0:
+            raise KeyError(addr)
+        return self.names[i]
+
+    def __setitem__(self, addr, network):
+        self.add(addr, network)
+
+    def __iter__(self):
+        for start, end, _ in self.intervals():
+            for addr in range(start, end + 1):
+                yield int_to_ip(addr)
+        yield from self.named
+
+    def __len__(self):
+        return (sum(e - s + 1 for s, e in zip(self.starts, self.ends))
+                + len(self.named))
+
+    def intervals(self):
+        """iterate over (start, end, network) integer intervals"""
+        return zip(self.starts, self.ends, self.names)
+
+    def chunks(self, size, bynetwork=False):
+        """
+        split the mapped targets into lists of at most size addresses,
+        as (start, end) integer ranges, plus any named targets in a
+        last chunk of their own. With bynetwork, a chunk never spans
+        two networks.
+        """
+        chunk, count, network = [], 0, None
+        for start, end, name in self.intervals():
+            if bynetwork and chunk and name != network:
+                yield chunk
+                chunk, count = [], 0
+            network = name
+            while start <= end:
+                take = min(end - start + 1, size - count)
+                chunk.append((start, start + take - 1))
+                count += take
+                start += take
+                if count == size:
+                    yield chunk
+                    chunk, count = [], 0
+        if chunk:
+            yield chunk
+        if self.named:
+            yield list(self.named)
+
+    def sizes(self):
+        """dict of each network's number of mapped targets"""
+        sizes = dict.fromkeys(self.networks(), 0)
+        for start, end, name in self.intervals():
+            sizes[name] += end - start + 1
+        for name in self.named.values():
+            sizes[name] += 1
+        return sizes
+
+    def spans(self):
+        """
+        the mapped addresses as sorted (start, end) ranges, merging
+        adjacent intervals of different networks
+        """
+        spans = []
+        for start, end, _ in self.intervals():
+            if spans and spans[-1][1] + 1 == start:
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+        return spans
+
+    def cidrs(self):
+        """the minimal list of CIDR strings covering the mapped addresses"""
+        return [c for start, end in self.spans() for c in range_cidrs(start, end)]
+
+    def complement(self, start=0, end=2**32 - 1):
+        """
+        the (start, end) ranges of addresses between start and end
+        that aren't mapped, found with a single sweep of the intervals
+        """
+        gaps = []
+        for first, last in self.spans():
+            if last < start:
+                continue
+            if first > end:
+                break
+            if first > start:
+                gaps.append((start, first - 1))
+            start = last + 1
+        if start <= end:
+            gaps.append((start, end))
+        return gaps
+
+    def networks(self):
+        """sorted names of all mapped networks"""
+        return sorted(set(self.names) | set(self.named.values()))
+
+    def classify(self, addrs):
+        """
+        look up the networks of many addresses at once, None where
+        an address isn't mapped. Vectorized with numpy if available.
+        Targets that aren't IPv4 addresses, e.g. domain names, are
+        looked up among the named targets instead.
+        """
+        addrs = list(addrs)
+        if np is None or not self.starts:
+            return [self.get(a) for a in addrs]
+        result = [None] * len(addrs)
+        ints, where = [], []
+        for i, addr in enumerate(addrs):
+            if not isinstance(addr, int):
+                try:
+                    addr = ip_to_int(addr)
+                except OSError:
+                    result[i] = self.named.get(addr)
+                    continue
+            ints.append(addr)
+            where.append(i)
+        ints = np.array(ints, dtype=np.uint64)
+        starts = np.asarray(self.starts, dtype=np.uint64)
+        ends = np.asarray(self.ends, dtype=np.uint64)
+        idx = np.searchsorted(starts, ints, side='right') - 1
+        found = (idx >= 0) & (ints <= ends[np.maximum(idx, 0)])
+        for i, n, f in zip(where, idx.tolist(), found.tolist()):
+            if f:
+                result[i] = self.names[n]
+        return result
+
     # TODO: make alternative constructor/factory class method
     # @classmethod
     def fromstr(self, string):
@@ -118,11 +530,10 @@ class IPFile(odict):
                 ips = line[1].strip()
                 ips = ips.split(',')
                 ips = [i.strip() for i in ips]
-                ranges = [i for i in ips for i in iprange_decode(i)]
-                for ip in ranges:
-                    self[ip] = sect
+                for ip in ips:
+                    self.add(ip, sect)
             else:  # TODO: consider
-                self[line] = 'Misc'
+                self.add(line, 'Misc')
     # @classmethod
     def fromfile(self, filename):
         """extract IPs from *.ips file"""
@@ -131,116 +542,634 @@ class IPFile(odict):
             self.fromstr(string)
     def fromnmapxml(self, filename):
         """extract IPs from nmap xml scan log"""
-        nmapxml = xmlparse(open(filename).read(), force_list=xmlforced)
-        if 'host' not in nmapxml['nmaprun']:
+        scanned = False
+        for host in iterhosts(filename):
+            scanned = True
+            self[host.address] = 'Miscellaneous'  # TODO: add global/config setting
+        if not scanned:
             raise Exception('No hosts scanned\n{}\n'.format(hostspath))
-        for host in nmapxml['nmaprun']['host']:
-            if isinstance(host['address'], list):
-                host['address'] = host['address'][0]
-            addr = host['address']['@addr']  # XXX: ensure ipv4 addr
-            # print(addr, type(addr))
-            self[addr] = 'Miscellaneous'  # TODO: add global/config setting
-
-def parse_result(output=sys.stdout):
+
+HostRecord = namedtuple('HostRecord', ('address', 'hostname', 'hops'))
+"""
+compact record of a scanned host, hops is a list of
+(index, hostname, address) tuples, the same as a traceblob,
+or None if nmap logged no trace of the host
+"""
+
+def hostrecord(host):
+    """build a HostRecord from an nmap <host> element"""
+    addr = host.find('address').get('addr')  # XXX: ensure ipv4 addr
+    # in case hostnames is empty or the tag doesn't even exist
+    name = host.find('hostnames/hostname')
+    hostname = addr if name is None else name.get('name')
+    if host.find('trace') is None:
+        return HostRecord(addr, hostname, None)
+    hops = []
+    for hop in host.iterfind('trace/hop'):
+        # TODO: Add a black hole for unknown trace nodes if possible
+        ipaddr = hop.get('ipaddr')
+        hophost = hop.get('host')
+        hops.append( (hop.get('ttl'),
+                      hophost if hophost is not None else ipaddr,
+                      ipaddr) )
+    return HostRecord(addr, hostname, hops)
+
+def hoststatus(host):
+    """the address and state (up, down) of an nmap <host> element"""
+    return host.find('address').get('addr'), host.find('status').get('state')
+
+def iterhosts(nmapxml=None, record=hostrecord):
+    """
+    incrementally parse an nmap xml scan log, yielding a HostRecord
+    (or whatever record builds) for each <host> as soon as it is read,
+    and freeing its element, so memory use doesn't grow with the size
+    of the log
+    """
+    if nmapxml is None:
+        nmapxml = nmapxmlpath
+    context = ET.iterparse(nmapxml, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == 'host':
+            yield record(elem)
+            root.clear()
+
+def hostxml(record):
+    """convert a HostRecord into the trace.xml host structure"""
+    # if you're unfamiliar with the '@keys' convention,
+    # odict use and etc, you should read the xmltodict
+    # module docs
+    newhost = odict()
+    newhost['address'] = record.address
+    newhost['hostname'] = record.hostname
+    newhost['trace'] = odict()
+    newhost['trace']['hop'] = []
+    hops = record.hops if record.hops is not None else []
+    for index, hostname, address in hops:
+        newhop = odict()
+        newhop['index'] = index
+        newhop['hostname'] = hostname
+        newhop['address'] = address
+        newhost['trace']['hop'].append(newhop)
+    newhost['traceblob'] = str(hops)
+    return newhost
+
+def loadxml(xml):
+    """
+    the trace.xml structure of xml, a string, bytes or file,
+    passed through as is if it's already one, e.g. built in
+    memory by ciscotraceparser.log_to_networks
+    """
+    if isinstance(xml, dict):
+        return xml
+    return xmlparse(xml, force_list=xmlforced)
+
+def hostsortkey(record):
+    """order hosts within a network by hostname, then address"""
+    return (record.hostname if record.hostname is not None else '',
+            record.address)
+
+def group_hosts(hosts, spool, networks=None):
+    """
+    bucket HostRecords by their iplist network in a single pass,
+    writing each to the spool file as a json line as soon as it's
+    read, returning an odict of network names (sorted) to the
+    (hostsortkey, offset) of their hosts in the spool, each sorted
+    once, so only the sort keys are held in memory
+    """
+    if networks is None:
+        networks = iplist.networks()
+    buckets = odict((n, []) for n in sorted(set(networks)))
+    for record in hosts:
+        buckets[iplist[record.address]].append(
+                (hostsortkey(record), spool.tell()))
+        spool.write(json.dumps(record).encode() + b'\n')
+    for bucket in buckets.values():
+        bucket.sort()
+    return buckets
+
+def spooled_hosts(spool, bucket):
+    """read back the HostRecords of a group_hosts bucket"""
+    for _, offset in bucket:
+        spool.seek(offset)
+        address, hostname, hops = json.loads(spool.readline())
+        if hops is not None:
+            hops = [tuple(h) for h in hops]
+        yield HostRecord(address, hostname, hops)
+
+def parse_result(output=sys.stdout, hosts=None, dead=None):
+    """
+    aggregate scanned hosts into the trace.xml schema, hosts is
+    an iterable of HostRecords, by default streamed from the nmap log.
+    dead optionally maps networks to their number of unresponsive
+    hosts, which are reported as each network's <deadhosts>.
+    Hosts are spooled to a temporary file as they're parsed, and
+    read back one at a time while the result is written.
+    """
     print('Parsing nmap results if they exist from scan...')
-    try:
-        nmapxml = xmlparse(open(nmapxmlpath, 'rb'), force_list=xmlforced)
-    except FileNotFoundError as e:
-        print('The results of the scan do not exist or have been moved!')
-        raise
-    scans = (nmapxml,)  #, nmapxml2)
-
-    newxml = odict()
-    newxml['networks'] = odict()
-    newxml['networks']['network'] = []
-
-    # extract and aggregate data from scans
-    # TODO: remove terrible naming (referring to previous var)
-    for nmapxml in scans:
-        for network in sorted(list(set(iplist.values()))):
-            # TODO: custom exception class
-            if 'host' not in nmapxml['nmaprun']:
-                raise Exception('No hosts scanned\n{}\n{}\n'.format(nmapxml, hostspath))
-            for host in nmapxml['nmaprun']['host']:  # XXX: isolate ipv4 address directly
-                if isinstance(host['address'], list):
-                    host['address'] = host['address'][0]
-            hosts = (n for n in nmapxml['nmaprun']['host'] if 
-                iplist[n['address']['@addr']] == network)
+    if hosts is None:
+        hosts = iterhosts(nmapxmlpath)
+    untraced = 0
+    def traced(hosts):
+        nonlocal untraced
+        for record in hosts:
+            if record.hops is None:
+                untraced += 1
+            yield record
+    with tempfile.TemporaryFile() as spool:
+        try:
+            buckets = group_hosts(traced(hosts), spool)
+        except FileNotFoundError as e:
+            print('The results of the scan do not exist or have been moved!')
+            raise
+        scanned = sum(len(b) for b in buckets.values())
+        # TODO: custom exception class
+        if not scanned and dead is None:
+            raise Exception('No hosts scanned\n{}\n'.format(hostspath))
+        if scanned and untraced == scanned:
+            raise Exception("It's likely that no traces were run, "
+                            "please inspect the nmap output")
+        if untraced:
+            print('{} of {} hosts have no trace, they are listed '
+                  'with empty traces'.format(untraced, scanned))
+
+        def networkxml(network, bucket):
             nethosts = odict()
-            newxml['networks']['network'].append(nethosts)
             nethosts['networkname'] = network
             nethosts['hosts'] = odict()
-            nethosts['hosts']['host'] = []
-            for host in hosts:
-                # do all the nasty xml creation
-                # if you're unfamiliar with the '@keys' convention, 
-                # odict use and etc, you should read the xmltodict 
-                # module docs
-                newhost = odict()
-                newhost['address'] = host['address']['@addr']
-                # in case hostnames is set to none or the tag doesn't even exist
-                if host.get('hostnames') is not None:
-                    newhost['hostname'] = host['hostnames']['hostname']['@name']
-                else:
-                    newhost['hostname'] = host['address']['@addr']
-                # newhost['networkname'] = iplist[host['address']['@addr']]
-                newhost['trace'] = odict()
-                newhost['trace']['hop'] = []
-                traceblob = []
-                try:
-                    for hop in host['trace']['hop']:
-                        # TODO: Add a black hole for unknown trace nodes if possible
-                        newhop = odict()
-                        newhop['index'] = hop['@ttl']
-                        # in case hostname is set to none or the tag doesn't even exist
-                        if hop.get('@host') is None:
-                            newhop['hostname'] = hop['@ipaddr']
-                        else:
-                            newhop['hostname'] = hop.get('@host')
-                        newhop['address'] = hop['@ipaddr']
-                        newhost['trace']['hop'].append(newhop)
-                        traceblob.append( (newhop['index'], 
-                                        newhop['hostname'] if newhop['hostname'] is not None else '',
-                                        newhop['address']) )
-                except KeyError as e:
-                    if str(e) == 'trace':
-                        raise Exception("It's likely that no traces were run, please inspect the nmap output")
-                newhost['traceblob'] = str(traceblob)
-                nethosts['hosts']['host'].append(newhost)
-                # sort
-                nethosts['hosts']['host'].sort(
-                        key=lambda t:(t['hostname'] if t['hostname'] is not None else '', 
-                        t.get('address', '')))
-    xmldump(newxml, output, pretty=True)
+            # generated lazily as xmldump writes them out, an empty
+            # list keeps empty networks serialized as <hosts></hosts>
+            nethosts['hosts']['host'] = (
+                    (hostxml(r) for r in spooled_hosts(spool, bucket))
+                    if bucket else [])
+            if dead is not None:
+                nethosts['deadhosts'] = str(dead.get(network, 0))
+            return nethosts
+
+        newxml = odict()
+        newxml['networks'] = odict()
+        newxml['networks']['network'] = (
+                networkxml(n, b) for n, b in buckets.items())
+        xmldump(newxml, output, pretty=True)
+
+def write_targets(f, targets, excludefile=None):
+    """
+    write nmap input targets, (start, end) integer ranges are written
+    as a compact CIDR cover, see compact_ranges, with the addresses to
+    leave out of it written to excludefile, strings are written as is.
+    Returns the number of exclusions written.
+    """
+    ranges = sorted(t for t in targets if not isinstance(t, str))
+    if excludefile is None:
+        covered, excluded = ranges, []
+    else:
+        covered, excluded = compact_ranges(ranges)
+    for start, end in covered:
+        for cidr in range_cidrs(start, end):
+            f.write('{}\n'.format(cidr))
+    for target in targets:
+        if isinstance(target, str):
+            f.write('{}\n'.format(target))
+    count = 0
+    for start, end in excluded:
+        for cidr in range_cidrs(start, end):
+            excludefile.write('{}\n'.format(cidr))
+            count += 1
+    return count
+
+def tailhosts(xmlpath, proc, record=hostrecord):
+    """
+    follow an nmap xml log while the running proc writes it, yielding
+    a record for each <host> as soon as its element is complete
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root, log = None, None
+    try:
+        running = True
+        while running:
+            # one last read once the process has exited
+            running = proc.poll() is None
+            if log is None and path.exists(xmlpath):
+                log = open(xmlpath, 'rb')
+            if log is not None:
+                parser.feed(log.read())
+                for event, elem in parser.read_events():
+                    if root is None:
+                        root = elem
+                    elif event == 'end' and elem.tag == 'host':
+                        yield record(elem)
+                        root.clear()
+            if running:
+                time.sleep(tailpoll)
+    finally:
+        if log is not None:
+            log.close()
+
+def nmap(targets, xmlpath, listpath, cmd=None, onhost=None):
+    """
+    run nmap (cmd) over targets, writing its xml log to xmlpath,
+    if given, onhost is called with each HostRecord as nmap logs it
+    """
+    if cmd is None:
+        cmd = nmapcmd
+    excludepath = listpath + '.exclude'
+    with open(listpath, 'w') as hostsfile, open(excludepath, 'w') as excludefile:
+        excluded = write_targets(hostsfile, targets, excludefile)
+    args = cmd + ['-oX', xmlpath, '-iL', listpath]
+    if excluded:
+        args += ['--excludefile', excludepath]
+    try:
+        if onhost is None:
+            subproc.check_output(args, stderr=subproc.STDOUT)  # replace with run in py>=3.5
+        else:
+            nmap_tail(args, xmlpath, onhost)
+    finally:
+        os.remove(excludepath)
+
+def nmap_tail(args, xmlpath, onhost):
+    """run nmap with args, calling onhost with each host it logs"""
+    # don't tail a stale log before nmap replaces it
+    if path.exists(xmlpath):
+        os.remove(xmlpath)
+    with tempfile.TemporaryFile() as out:
+        proc = subproc.Popen(args, stdout=out, stderr=subproc.STDOUT)
+        for record in tailhosts(xmlpath, proc):
+            onhost(record)
+        if proc.returncode:
+            out.seek(0)
+            raise subproc.CalledProcessError(proc.returncode, args, out.read())
+
+def doubletree_trace(targets, output=None):
+    """
+    trace targets with the doubletree engine, writing the result
+    as an nmap style xml log to output, by default nmapxmlpath
+    """
+    if output is None:
+        output = nmapxmlpath
+    engine = doubletree.Doubletree()
+    dests = itertools.chain(
+            (int_to_ip(a) for s, e, _ in targets.intervals()
+                for a in range(s, e + 1)),
+            targets.named)
+    results = engine.run(dests)
+    print('Doubletree sent {} probes'.format(engine.probes))
+    with open(output, 'wb') as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                  b'<!DOCTYPE nmaprun>\n<nmaprun scanner="doubletree">\n')
+        for dest, hostname, hops in results:
+            host = ET.Element('host')
+            ET.SubElement(host, 'status', state='up', reason='user-set')
+            ET.SubElement(host, 'address', addr=dest, addrtype='ipv4')
+            names = ET.SubElement(host, 'hostnames')
+            if hostname is not None:
+                ET.SubElement(names, 'hostname', name=hostname, type='PTR')
+            trace = ET.SubElement(host, 'trace', proto='udp')
+            for ttl, addr, name in hops:
+                hop = ET.SubElement(trace, 'hop', ttl=str(ttl), ipaddr=addr)
+                if name is not None:
+                    hop.set('host', name)
+            host.tail = '\n'
+            out.write(ET.tostring(host))
+        out.write(b'</nmaprun>\n')
+
+def merge_nmap_logs(paths, output):
+    """
+    concatenate the <host> elements of several nmap xml logs into
+    one log at output, streaming each so none is held in memory.
+    A truncated log keeps the hosts that were read before the break.
+    """
+    with open(output, 'wb') as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                  b'<!DOCTYPE nmaprun>\n<nmaprun scanner="nmap">\n')
+        for logpath in paths:
+            try:
+                context = ET.iterparse(logpath, events=('start', 'end'))
+                _, root = next(context)
+                for event, elem in context:
+                    if event == 'end' and elem.tag == 'host':
+                        elem.tail = '\n'
+                        out.write(ET.tostring(elem))
+                        root.clear()
+            except ET.ParseError as e:
+                print('Nmap log {} is malformed, keeping the hosts '
+                      'read before: {}'.format(logpath, e))
+        out.write(b'</nmaprun>\n')
+
+class Checkpoint:
+    """
+    a directory of a scan's numbered chunks: a manifest of each chunk's
+    targets, and each chunk's host list and nmap log. A chunk's log is
+    only moved into place once its nmap has finished successfully, so
+    the chunks that are done survive an interruption.
+    """
+    def __init__(self, directory):
+        self.dir = directory
+        self.manifest = path.join(directory, 'manifest.json')
+
+    def exists(self):
+        return path.exists(self.manifest)
+
+    def start(self, chunks):
+        """start a new checkpoint of chunks, replacing any old one"""
+        self.clear()
+        os.makedirs(self.dir)
+        with open(self.manifest, 'w') as f:
+            json.dump(chunks, f)
+
+    def chunks(self):
+        """the chunks of the checkpointed scan"""
+        with open(self.manifest) as f:
+            return [[t if isinstance(t, str) else tuple(t) for t in chunk]
+                    for chunk in json.load(f)]
+
+    def logpath(self, n):
+        return path.join(self.dir, 'chunk{:05d}.xml'.format(n))
+
+    def listpath(self, n):
+        return path.join(self.dir, 'chunk{:05d}.hosts'.format(n))
+
+    def done(self, n):
+        return path.exists(self.logpath(n))
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+def trace_shards(shards, workers=None, cmd=None, output=None, onhost=None,
+                 checkpoint=None):
+    """
+    run nmap (cmd) over each shard (a list of targets) concurrently, and
+    merge their logs into output, by default nmapxmlpath. A failed shard
+    is reported and left out instead of failing the scan, unless every
+    shard fails. Returns the list of failed shard indexes.
+    If given, onhost is called with the HostRecords of each shard as
+    soon as it finishes.
+    With a Checkpoint, the shards' logs are kept in it, and shards it
+    already has the logs of are not scanned again.
+    """
+    if workers is None:
+        workers = concurrency
+    if output is None:
+        output = nmapxmlpath
+    if checkpoint is None:
+        workdir = tempfile.mkdtemp(prefix='.temp_shards')
+        logpath = lambda n: path.join(workdir, 'shard{}.xml'.format(n))
+        listpath = lambda n: path.join(workdir, 'shard{}.hosts'.format(n))
+        done = lambda n: False
+    else:
+        workdir = checkpoint.dir
+        logpath, listpath, done = (
+            checkpoint.logpath, checkpoint.listpath, checkpoint.done)
+    def runshard(n):
+        if done(n):
+            return logpath(n)
+        partial = logpath(n) + '.part'
+        nmap(shards[n], partial, listpath(n), cmd)
+        os.replace(partial, logpath(n))
+        return logpath(n)
+    logs, failed = {}, []
+    skipped = sum(1 for n in range(len(shards)) if done(n))
+    if skipped:
+        print('{} of {} chunks are already done'.format(skipped, len(shards)))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(runshard, n): n for n in range(len(shards))}
+            try:
+                for future in as_completed(futures):
+                    n = futures[future]
+                    try:
+                        logs[n] = future.result()
+                    except (subproc.CalledProcessError, OSError) as e:
+                        failed.append(n)
+                        print('Shard {} of {} failed'.format(n + 1, len(shards)))
+                        print(getattr(e, 'output', e))
+                        continue
+                    print('Shard {} of {} finished'.format(n + 1, len(shards)))
+                    if onhost is None:
+                        continue
+                    try:
+                        for record in iterhosts(logs[n]):
+                            onhost(record)
+                    except Exception as e:
+                        # a malformed log, or onhost failing on its hosts,
+                        # drop the log so a resumed scan runs it again
+                        failed.append(n)
+                        print('Shard {} of {} could not be read: {}'.format(
+                            n + 1, len(shards), e))
+                        os.remove(logs.pop(n))
+            except KeyboardInterrupt:
+                # don't start the pending shards, the finished ones
+                # are checkpointed for --resume
+                print('Interrupted, cancelling the shards not yet started')
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+        if not logs:
+            raise Exception('Every nmap shard failed\n{}\n'.format(workdir))
+        merge_nmap_logs([logs[n] for n in sorted(logs)], output)
+    finally:
+        if checkpoint is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return sorted(failed)
 
 # TODO: add proper output and parameters instead of iplist
 # it's better to rely on parameters than some global scope object,
 # more predictable, etc
-def trace():
-    """Runs nmap over hosts, then generates XML data from the result."""
+def trace(size=None, workers=None, targets=None, onhost=None, resume=False):
+    """
+    Runs nmap over hosts, then generates XML data from the result.
+    targets is an IPFile, by default iplist.
+    If size (or the module's shardsize) is set, the hosts are split
+    into shards of that many addresses run by concurrent nmaps.
+    With the doubletree backend, the built-in engine traces every
+    host instead, and sharding doesn't apply.
+    If given, onhost is called with each HostRecord as soon as the
+    scan has completed it.
+    Sharded scans are checkpointed in numbered chunks to checkpointdir,
+    with resume, the chunks of the checkpointed scan are used instead
+    of targets, and the ones that are already done are skipped. The
+    checkpoint is removed once every chunk is done.
+    """
+    if targets is None:
+        targets = iplist
+    if backend == 'doubletree':
+        if resume:
+            print('Doubletree scans are not checkpointed, tracing every target')
+        print('Running doubletree traces over network(s) in iplists object')
+        doubletree_trace(targets)
+        if onhost is not None:
+            for record in iterhosts(nmapxmlpath):
+                onhost(record)
+        return []
     print('Running nmap scan(s) over network(s) in iplists object')
-    # prepare hosts file for nmap
-    with open(hostspath, 'w') as hostsfile:
-        for ip in iplist:
-            hostsfile.write('{}\n'.format(ip))
+    if size is None:
+        size = shardsize
+    if resume and not size:
+        size = chunksize
+    if size:
+        checkpoint = Checkpoint(checkpointdir)
+        if resume and checkpoint.exists():
+            shards = checkpoint.chunks()
+            print('Resuming a scan of {} chunks'.format(len(shards)))
+        else:
+            shards = list(targets.chunks(size, shardbynetwork))
+            checkpoint.start(shards)
+            print('Split into {} shards'.format(len(shards)))
+        failed = trace_shards(shards, workers, onhost=onhost,
+                              checkpoint=checkpoint)
+        if not failed:
+            checkpoint.clear()
+        return failed
 
     # perform nmap scan
-    args = ['nmap', '--privileged', '-sn', '-Pn', '-T5', '--traceroute', 
-            '-v', '-oX', nmapxmlpath, '-iL', hostspath]
     try:
-        subproc.check_output(args)  # replace with run in py>=3.5
+        nmap([(s, e) for s, e, _ in targets.intervals()] + list(targets.named),
+             nmapxmlpath, hostspath, onhost=onhost)
     except subproc.CalledProcessError as e:
         print('Nmap failed to run')
         print(e.output)
         raise
     os.remove(hostspath)
+    return []
+
+def discover(targets, size=None, workers=None):
+    """
+    fast host discovery pass over targets (an IPFile), returns an IPFile
+    of the responsive hosts and a dict of each network's dead host
+    count. Hosts of failed shards, and named targets, count as live.
+    """
+    print('Running host discovery over network(s) in iplists object')
+    if size is None:
+        size = shardsize
+    # (start, end) ranges of the live addresses
+    up = []
+    if size:
+        shards = list(targets.chunks(size, shardbynetwork))
+        failed = trace_shards(shards, workers, discoverycmd, discoverypath)
+        for n in failed:
+            up.extend(t for t in shards[n] if not isinstance(t, str))
+    else:
+        try:
+            nmap([(s, e) for s, e, _ in targets.intervals()] + list(targets.named),
+                 discoverypath, hostspath, discoverycmd)
+        except subproc.CalledProcessError as e:
+            print('Nmap failed to run')
+            print(e.output)
+            raise
+    for addr, state in iterhosts(discoverypath, hoststatus):
+        if state == 'up':
+            up.append((ip_to_int(addr),) * 2)
+    live = targets.only(up)
+    live.named.update(targets.named)
+    os.remove(discoverypath)
+    alive = live.sizes()
+    dead = {n: count - alive.get(n, 0) for n, count in targets.sizes().items()}
+    print('{} of {} hosts responded'.format(len(live), len(targets)))
+    return live, dead
+
+class Progress:
+    """
+    collects HostRecords as a scan completes them, and every interval
+    seconds writes a partial trace.xml of them to resultpath, then
+    calls onupdate(resultpath), so that downstream outputs, e.g. the
+    csv and svgs, can be refreshed during long scans
+    """
+    def __init__(self, interval, onupdate=None, hosts=(), dead=None):
+        self.interval = interval
+        self.onupdate = onupdate
+        self.records = list(hosts)
+        self.dead = dead
+        self.last = time.monotonic()
+
+    def __call__(self, record):
+        self.records.append(record)
+        if time.monotonic() - self.last >= self.interval:
+            self.refresh()
+
+    def refresh(self):
+        """write the partial trace.xml and notify onupdate"""
+        self.last = time.monotonic()
+        if not self.records and self.dead is None:
+            return
+        with open(resultpath, 'w') as partial:
+            parse_result(partial, iter(self.records), self.dead)
+        print('Partial results of {} hosts written to {}'.format(
+            len(self.records), resultpath))
+        if self.onupdate is not None:
+            self.onupdate(resultpath)
 
 # TODO: unconfuse the parameter names from cli args
-def run(do_scan=True, keep_logs=False, output=sys.stdout):
-    if do_scan:
-        trace()
-    parse_result(output)
-    if not keep_logs and do_scan:
+def run(do_scan=True, keep_logs=False, output=sys.stdout,
+        shardsize=None, workers=None, cache=False, ttl=None, twophase=False,
+        progress=None, onupdate=None, resume=False):
+    """
+    scan and write the aggregated result to output. With cache,
+    only hosts without a fresh entry in the trace cache are scanned,
+    and the result merges the fresh and cached traces, hosts the
+    scan got no trace of aren't cached, so they're scanned again
+    next time, without
+    do_scan, the existing log's traces are cached as of the time it
+    was last written. With twophase,
+    a host discovery sweep runs first and only responsive hosts are
+    traced, the others are counted as each network's dead hosts.
+    With progress, a partial result is written to resultpath every
+    progress seconds while the scan runs, see Progress.
+    With resume, an interrupted scan checkpointed in checkpointdir is
+    continued, skipping its completed chunks (and the cache and host
+    discovery filtering that chose its targets). The checkpoint is
+    removed once every chunk is done.
+    """
+    tc = None
+    if cache:
+        tc = tracecache.TraceCache(cachepath, cachettl if ttl is None else ttl)
+    hosts, dead = None, None
+    scanned = False
+    try:
+        if do_scan:
+            checkpoint = Checkpoint(checkpointdir)
+            resuming = (resume and backend != 'doubletree'
+                        and checkpoint.exists())
+            targets = iplist
+            if tc is not None and not resuming:
+                targets = iplist.without(
+                        address for address, _, _ in tc.fresh())
+                print('{} of {} hosts have fresh cached traces'.format(
+                    len(iplist) - len(targets), len(iplist)))
+            if twophase and targets and not resuming:
+                targets, dead = discover(targets, shardsize, workers)
+            onhost = None
+            if progress is not None:
+                cached = ()
+                if tc is not None:
+                    cached = (HostRecord(*r) for r in tc.fresh() if r[0] in iplist)
+                onhost = Progress(progress, onupdate, cached, dead)
+            if targets or resuming:
+                failed = trace(shardsize, workers, targets, onhost, resume)
+                if failed:
+                    print('{} chunks failed, rerun with --resume to retry '
+                          'only them'.format(len(failed)))
+                scanned = True
+            else:
+                hosts = iter(())
+        else:
+            scanned = path.exists(nmapxmlpath)
+        if tc is not None:
+            untraced = []
+            if scanned:
+                # an old log's traces are only as fresh as the log
+                tc.update(iterhosts(nmapxmlpath), None if do_scan
+                          else path.getmtime(nmapxmlpath))
+                # not cached, so they're scanned again next time,
+                # but still part of this result
+                untraced = [r for r in iterhosts(nmapxmlpath)
+                            if r.hops is None and r.address in iplist
+                            and tc.get(r.address) is None]
+            hosts = itertools.chain(
+                    (HostRecord(*r) for r in tc.fresh() if r[0] in iplist),
+                    untraced)
+        parse_result(output, hosts, dead)
+    finally:
+        if tc is not None:
+            tc.close()
+    if not keep_logs and do_scan and scanned:
         os.remove(nmapxmlpath)
 
 iplist = IPFile()
@@ -263,6 +1192,31 @@ if __name__ == '__main__':
                     help='file to write results to, this currently overwrites')
     p.add_argument('-N', '--network-name', default='Misc',
                     help='name of the network for commandline argument IPs')
+    p.add_argument('-s', '--shard-size', type=int, default=shardsize,
+                    help='split the scan into concurrent nmap runs of at '
+                    'most this many addresses')
+    p.add_argument('-S', '--shard-by-network', action='store_true',
+                    help='never let a shard span two networks')
+    p.add_argument('-j', '--concurrency', type=int, default=concurrency,
+                    help='maximum number of concurrent nmap shards')
+    p.add_argument('-c', '--cache', action='store_true',
+                    help='only trace hosts without a fresh trace in the '
+                    'trace cache, and merge in the cached traces')
+    p.add_argument('-t', '--cache-ttl', type=float, default=cachettl / 3600,
+                    help='hours before a cached trace is traced again')
+    p.add_argument('-l', '--live-only', action='store_true',
+                    help='run a host discovery sweep first, and only trace '
+                    'the hosts that respond')
+    p.add_argument('-b', '--backend', choices=('nmap', 'doubletree'),
+                    default=backend,
+                    help='traceroute backend, nmap or the built-in doubletree '
+                    'engine, which skips hops already discovered by other traces')
+    p.add_argument('-p', '--progress', type=float, default=None,
+                    help='write partial results to {} every this many '
+                    'seconds while scanning'.format(resultpath))
+    p.add_argument('-r', '--resume', action='store_true',
+                    help='continue an interrupted sharded scan from its '
+                    'checkpointed chunks, skipping the completed ones')
     p.add_argument('IPs', metavar='IP', type=str, nargs='*',
                     help='IPs to scan')
     args = p.parse_args()
@@ -281,7 +1235,9 @@ if __name__ == '__main__':
     if args.output is not sys.stdout:
         args.output = open(args.output, 'w')
 
-    do_scan = bool(args.no_scan) is None
+    do_scan = args.no_scan is None
+    shardbynetwork = args.shard_by_network
+    backend = args.backend
     '''
     if args.no_scan is not None:
         iplist.fromnmapxml(args.no_scan)
@@ -290,7 +1246,14 @@ if __name__ == '__main__':
 
     run(do_scan,
         args.discard_log, 
-        args.output)
+        args.output,
+        args.shard_size,
+        args.concurrency,
+        args.cache,
+        args.cache_ttl * 3600,
+        args.live_only,
+        args.progress,
+        resume=args.resume)
     # clean up
     if path.exists(hostspath):
         os.remove(hostspath)
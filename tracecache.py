@@ -0,0 +1,172 @@
+"""
+A persistent, on-disk cache of traceroute data for individual hosts,
+so a scan only has to re-trace hosts whose paths are missing or have
+expired. Stored as a SQLite table keyed by target address.
+Cisco `trace mac` outputs are cached the same way, keyed by router,
+source mac, destination mac and vlan.
+
+PYTHON USAGE:
+    >>> cache = TraceCache('trace_cache.sqlite', ttl=24*60*60)
+    >>> cache.update(trace.iterhosts())
+    >>> for address, hostname, hops in cache.fresh(): ...
+    >>> macs = MacTraceCache('mactrace_cache.sqlite')
+    >>> macs.update([('rtr1', src, dst, 100, output)])
+    >>> macs.get('rtr1', src, dst, 100)
+"""
+
+__author__ = 'Michael Belousov'
+
+import sqlite3
+import json
+import time
+import threading
+
+default_ttl = 24 * 60 * 60
+"""seconds a cached trace stays fresh"""
+
+schema = '''
+    CREATE TABLE IF NOT EXISTS traces (
+        address     TEXT PRIMARY KEY,
+        hostname    TEXT,
+        hops        TEXT,
+        traced      REAL
+    )'''
+"""table of host traces, hops are a json list of (index, hostname, address)"""
+
+mactrace_schema = '''
+    CREATE TABLE IF NOT EXISTS mactraces (
+        router      TEXT,
+        src         TEXT,
+        dst         TEXT,
+        vlan        INTEGER,
+        output      TEXT,
+        traced      REAL,
+        PRIMARY KEY (router, src, dst, vlan)
+    )'''
+"""table of trace mac outputs, as send_command returned them"""
+
+
+class TraceCache:
+    """
+    SQLite backed cache of host traces, rows are
+    (address, hostname, hops) like trace.HostRecord
+    """
+    def __init__(self, dbpath, ttl=default_ttl):
+        self.ttl = ttl
+        self.db = sqlite3.connect(dbpath)
+        self.db.execute(schema)
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def cutoff(self, now=None):
+        """oldest trace timestamp that is still fresh"""
+        if now is None:
+            now = time.time()
+        return now - self.ttl
+
+    def update(self, records, now=None):
+        """store (address, hostname, hops) records, traced at now,
+        records without a trace (hops of None) aren't stored, so
+        hosts that were down are scanned again next time"""
+        if now is None:
+            now = time.time()
+        self.db.executemany(
+                'INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?)',
+                ((address, hostname, json.dumps(hops), now)
+                    for address, hostname, hops in records
+                    if hops is not None))
+        self.db.commit()
+
+    def get(self, address, now=None):
+        """the fresh record of an address, or None"""
+        row = self.db.execute(
+                'SELECT address, hostname, hops FROM traces '
+                'WHERE address = ? AND traced >= ?',
+                (address, self.cutoff(now))).fetchone()
+        return None if row is None else self.record(row)
+
+    def fresh(self, now=None):
+        """iterate over every record that hasn't expired"""
+        cursor = self.db.execute(
+                'SELECT address, hostname, hops FROM traces '
+                'WHERE traced >= ?', (self.cutoff(now),))
+        return (self.record(row) for row in cursor)
+
+    def expire(self, now=None):
+        """delete expired records"""
+        self.db.execute('DELETE FROM traces WHERE traced < ?',
+                        (self.cutoff(now),))
+        self.db.commit()
+
+    @staticmethod
+    def record(row):
+        """decode a row into an (address, hostname, hops) record"""
+        address, hostname, hops = row
+        hops = json.loads(hops)
+        return address, hostname, (
+                None if hops is None else [tuple(h) for h in hops])
+
+
+class MacTraceCache:
+    """
+    SQLite backed cache of cisco `trace mac` outputs, keyed by
+    (router, src mac, dst mac, vlan), shareable between threads
+    """
+    def __init__(self, dbpath, ttl=default_ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbpath, check_same_thread=False)
+        self.db.execute(mactrace_schema)
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def cutoff(self, now=None):
+        """oldest trace timestamp that is still fresh"""
+        if now is None:
+            now = time.time()
+        return now - self.ttl
+
+    def update(self, entries, now=None):
+        """store (router, src, dst, vlan, output) entries, traced at now"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.db.executemany(
+                    'INSERT OR REPLACE INTO mactraces '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    ((router, str(src), str(dst), int(vlan), output, now)
+                        for router, src, dst, vlan, output in entries))
+            self.db.commit()
+
+    def get(self, router, src, dst, vlan, now=None):
+        """the fresh output of a trace, or None"""
+        with self.lock:
+            row = self.db.execute(
+                    'SELECT output FROM mactraces WHERE router = ? AND '
+                    'src = ? AND dst = ? AND vlan = ? AND traced >= ?',
+                    (router, str(src), str(dst), int(vlan),
+                     self.cutoff(now))).fetchone()
+        return None if row is None else row[0]
+
+    def expire(self, now=None):
+        """delete expired outputs"""
+        with self.lock:
+            self.db.execute('DELETE FROM mactraces WHERE traced < ?',
+                            (self.cutoff(now),))
+            self.db.commit()
@@ -8,12 +8,11 @@ TODO
     - organize this properly
 '''
 
-from xmltodict import parse as xmlparse, unparse as xmldump
 import networkx as nx
 from os import path
 import sys, os
 from datetime import datetime as dt
-from trace import xmlforced, root_dir
+from trace import loadxml, root_dir
 from hosttype import choose_icons_and_types
 from graphutils import hierarchy_pos, svg_from_nxgraph
 import subprocess as subproc
@@ -49,9 +48,9 @@ def svgstopdf(svgs, metadata={}):
     merger.write(docname)
 
 def visfromtracexml(xmlfile, format='svg', outpath=os.curdir, metadata={}):
-    """takes a file descriptor of an XML file generated by trace.py and
-    graphs each network in it as an SVG"""
-    xmldata = xmlparse(xmlfile, force_list=xmlforced)
+    """takes a file descriptor of an XML file generated by trace.py, or
+    its already parsed structure, and graphs each network in it as an SVG"""
+    xmldata = loadxml(xmlfile)
     # generate graph data from trace.xml
     graph_dump = []
     for net in xmldata['networks']['network']:
@@ -66,7 +65,8 @@ def visfromtracexml(xmlfile, format='svg', outpath=os.curdir, metadata={}):
             # construct the topology for the relevant hosts
             labels['PUBLIC'] = 'PUBLIC'  # root of all traces
             last = 'PUBLIC'
-            if host['trace'] is None: 
+            # empty traces parse as None, but are empty lists in memory
+            if host['trace'] is None or not host['trace']['hop']:
                 continue
             for hop in host['trace']['hop']:
                 G.add_edge(last, hop['address'])
@@ -76,29 +76,38 @@ def visfromtracexml(xmlfile, format='svg', outpath=os.curdir, metadata={}):
             G.add_edge(last, host['address'])
             labels[host['address']] = f'{host["hostname"]}'\
                                      '\n{host["address"]}'
+        if not G.number_of_edges():
+            # e.g. every trace of a vrf failed, nothing to lay out
+            print(f'{net["networkname"]} has no traces to graph')
+            continue
         graph_dump.append( (G, net['networkname'], labels) )
     # convert each to the appropriate format
     files= []
     for G, netname, labels in graph_dump:
-        pos = {}
-        # icons = {}
-        icons, types = choose_icons_and_types(labels)
-        pos = hierarchy_pos(G, 'PUBLIC')
-        filename = path.join(outpath, f'{netname}.{format}')
-        svg_from_nxgraph(G, 
-                        pos, 
-                        icons, 
-                        types,
-                        labels, 
-                        filename,
-                        f'{netname} Network',
-                        metadata)
-        files.append(filename)
-        print(filename)
+        files.append(visfromgraph(G, netname, labels, 'PUBLIC',
+                                  format, outpath, metadata))
         # TODO: add exception handling for bad graphs
     print('finished successfully')
     return files
 
+def visfromgraph(G, netname, labels, root='PUBLIC', format='svg',
+                 outpath=os.curdir, metadata={}):
+    """graphs a connected networkx graph, laid out in layers from
+    root, as an SVG named after the network, returns its filename"""
+    icons, types = choose_icons_and_types(labels)
+    pos = hierarchy_pos(G, root)
+    filename = path.join(outpath, f'{netname}.{format}')
+    svg_from_nxgraph(G, 
+                    pos, 
+                    icons, 
+                    types,
+                    labels, 
+                    filename,
+                    f'{netname} Network',
+                    metadata)
+    print(filename)
+    return filename
+
 def run(inputxml, outpath, metadata={}):
     files = visfromtracexml(inputxml, 
             format='svg', 